@@ -0,0 +1,122 @@
+"""
+Whole-surface pixel analysis with numpy, for building collision masks,
+finding colourkeys and scanning tiles without a get_at call per pixel.
+Everything except the collision masks needs numpy.
+"""
+import pygame
+
+try:
+    import numpy
+    import pygame.surfarray
+except ImportError:
+    numpy = None
+
+def hasNumpy():
+    if numpy is None:
+        print "Surface analysis needs numpy"
+        return False
+    return True
+
+def readPixels(surface, points=None, alpha=True):
+    """
+    Returns the colours of a surface as a numpy array of shape
+    (width, height, 4), or (width, height, 3) if alpha is False. If points
+    is a list of (x, y) pixels, only their colours are returned, one row
+    per point.
+    """
+    if not hasNumpy():
+        return None
+    colours = pygame.surfarray.array3d(surface)
+    if alpha:
+        if surface.get_flags() & pygame.SRCALPHA:
+            alphas = pygame.surfarray.array_alpha(surface)
+        else:
+            alphas = numpy.empty(colours.shape[:2], dtype=numpy.uint8)
+            alphas.fill(surface.get_alpha() or 255)
+            colourkey = surface.get_colorkey()
+            if colourkey is not None:
+                alphas[packColours(colours) ==
+                       packColours(numpy.array(colourkey[:3]))] = 0
+        colours = numpy.dstack((colours, alphas))
+    if points is None:
+        return colours
+    points = numpy.asarray(points)
+    return colours[points[:, 0], points[:, 1]]
+
+def packColours(colours):
+    """
+    Packs an array of RGB colours into one integer per colour
+    """
+    colours = colours.astype(numpy.int32)
+    return (colours[..., 0] << 16) | (colours[..., 1] << 8) | colours[..., 2]
+
+def tileHistograms(surface, tileSize, bins=4):
+    """
+    Returns a colour histogram for every tile of a surface, as an array of
+    shape (across, down, bins, bins, bins) counting the pixels of each tile
+    that fall into each red, green and blue bin. Partial tiles at the right
+    and bottom edges are left out.
+    """
+    if not hasNumpy():
+        return None
+    tileWidth, tileHeight = tileSize
+    colours = pygame.surfarray.pixels3d(surface)
+    across = colours.shape[0] // tileWidth
+    down = colours.shape[1] // tileHeight
+    colours = colours[:across * tileWidth, :down * tileHeight]
+    quantised = colours.astype(numpy.int32) * bins // 256
+    colourBins = (quantised[..., 0] * bins + quantised[..., 1]) * bins + \
+        quantised[..., 2]
+    # the tile each pixel belongs to, as tileX * down + tileY
+    tiles = ((numpy.arange(across * tileWidth) // tileWidth)[:, None] * down +
+             (numpy.arange(down * tileHeight) // tileHeight)[None, :])
+    counts = numpy.bincount((tiles * bins ** 3 + colourBins).ravel(),
+                            minlength=across * down * bins ** 3)
+    del colours
+    return counts.reshape(across, down, bins, bins, bins)
+
+def detectColourkey(surface, coverage=0.5):
+    """
+    Returns the (R,G,B) colour making up at least coverage of a surface's
+    border pixels, the usual sign of a colourkeyed background, or None
+    """
+    if not hasNumpy():
+        return None
+    colours = pygame.surfarray.pixels3d(surface)
+    border = numpy.concatenate((colours[0], colours[-1],
+                                colours[1:-1, 0], colours[1:-1, -1]))
+    del colours
+    values, counts = numpy.unique(packColours(border), return_counts=True)
+    best = counts.argmax()
+    if counts[best] < coverage * len(border):
+        return None
+    value = int(values[best])
+    return ((value >> 16) & 255, (value >> 8) & 255, value & 255)
+
+def collisionMask(surface, threshold=127, cache=None):
+    """
+    Returns a pygame Mask of a surface's solid pixels: those above the
+    alpha threshold, or not the colourkey. cache is a WeakKeyDictionary
+    keeping masks alongside their surfaces; surfaces drawn on after their
+    mask was made must be removed from it.
+    """
+    if cache is not None:
+        masks = cache.get(surface)
+        if masks is None:
+            masks = cache[surface] = {}
+        mask = masks.get(threshold)
+        if mask is None:
+            mask = masks[threshold] = pygame.mask.from_surface(surface,
+                                                                threshold)
+        return mask
+    return pygame.mask.from_surface(surface, threshold)
+
+def overlap(surface, position, other, otherPosition, cache=None):
+    """
+    Returns the first overlapping solid pixel of two surfaces drawn at
+    two positions, relative to the first surface, or None if they don't
+    touch
+    """
+    offset = (otherPosition[0] - position[0], otherPosition[1] - position[1])
+    return collisionMask(surface, cache=cache).overlap(
+        collisionMask(other, cache=cache), offset)
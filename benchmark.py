@@ -0,0 +1,225 @@
+"""
+Benchmarks for Greasy. The engine benchmarks render headless, so they run
+without a display. Run with:
+
+    python benchmark.py [--save baseline.json] [--compare baseline.json]
+
+Each benchmark reports the mean, frames per second and 50th/95th/99th
+percentile times in milliseconds. --save writes them as JSON and
+--compare prints how the current run differs from a saved baseline.
+"""
+import grid as g
+import pathfinding as pf
+import argparse, json, os, random, tempfile
+from timeit import default_timer
+
+SIZES = (32, 128)
+DENSITIES = (0.1, 0.5)
+CELL = 8
+
+def timed(function, repeat=5):
+    """
+    Returns the fastest of repeat runs of function, in milliseconds
+    """
+    best = None
+    for n in range(repeat):
+        start = default_timer()
+        function()
+        elapsed = (default_timer() - start) * 1000
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def sample(function, count=50, setup=None):
+    """
+    Returns the time of count runs of function, in milliseconds. setup is
+    called before each run and isn't timed.
+    """
+    times = []
+    for n in range(count):
+        if setup:
+            setup()
+        start = default_timer()
+        function()
+        times.append((default_timer() - start) * 1000)
+    return times
+
+def summarise(times):
+    """
+    Returns the mean, fps and percentiles of a list of times
+    """
+    times = sorted(times)
+    mean = sum(times) / len(times)
+    def percentile(p):
+        return times[min(len(times) - 1, int(len(times) * p / 100.0))]
+    return {"mean": mean,
+            "fps": 1000.0 / mean if mean else 0.0,
+            "p50": percentile(50),
+            "p95": percentile(95),
+            "p99": percentile(99)}
+
+def obstacleGrid(size, density=0.2, seed=1):
+    """
+    Returns a size x size Grid with a fraction of its cells blocked
+    """
+    random.seed(seed)
+    obstacles = g.Grid(size, size)
+    for r in range(size):
+        for c in range(size):
+            if random.random() < density:
+                obstacles.setItem(1, r, c)
+    obstacles.setItem(0, 0, 0)
+    obstacles.setItem(0, size - 1, size - 1)
+    return obstacles
+
+def benchmarkPathfinding(size=512):
+    obstacles = obstacleGrid(size)
+    pathfinder = pf.Pathfinder(obstacles)
+    start = (0, 0)
+    goal = (size - 1, size - 1)
+    results = {}
+
+    def search():
+        pathfinder.paths = {}
+        pathfinder.findPath(start, goal)
+    results["astar"] = timed(search, 3)
+    results["astar cached"] = timed(lambda: pathfinder.findPath(start, goal))
+
+    def flow():
+        pathfinder.fields = {}
+        pathfinder.flowField(goal)
+    results["flow field"] = timed(flow, 3)
+
+    agents = [(random.randrange(size), random.randrange(size))
+              for n in range(500)]
+    results["flow field 500 agent steps"] = timed(
+        lambda: [pathfinder.nextStep(goal, agent) for agent in agents])
+
+    # one agent stepping back and forth, repairing the field each time
+    first = [agent for agent in agents if obstacles.getItem(*agent) == 0 and
+             pathfinder.nextStep(goal, agent)][0]
+    cells = [first, pathfinder.nextStep(goal, first)]
+    obstacles.setItem(1, cells[0][0], cells[0][1])
+    pathfinder.cellChanged(*cells[0])
+    def moveAgent():
+        cells.reverse()
+        obstacles.setItem(0, cells[1][0], cells[1][1])
+        pathfinder.cellChanged(*cells[1])
+        obstacles.setItem(1, cells[0][0], cells[0][1])
+        pathfinder.cellChanged(*cells[0])
+        pathfinder.flowField(goal)
+    results["flow field agent move"] = timed(moveAgent)
+    return results
+
+def makeEngine(size):
+    import engine
+    return engine.GreasyEngine(size, size, CELL, CELL, headless=True)
+
+def populate(greasy, density, seed=1):
+    """
+    Fills a fraction of the engine's grid with sprites and returns them
+    """
+    import pygame
+    random.seed(seed)
+    sprite = pygame.Surface((CELL, CELL)).convert()
+    sprite.fill((255, 0, 0))
+    greasy.emptyGrid()
+    for r, c in greasy.gameGrid:
+        if random.random() < density:
+            greasy.addObject(sprite, r, c)
+    return sprite
+
+def benchmarkEngine(sizes=SIZES, densities=DENSITIES):
+    """
+    Returns summaries of the engine benchmarks, keyed by name
+    """
+    import pygame
+    results = {}
+    for size in sizes:
+        greasy = makeEngine(size)
+        tile = pygame.Surface((CELL, CELL)).convert()
+        tile.fill((0, 0, 255))
+        for density in densities:
+            label = "%dx%d %d%%" % (size, size, density * 100)
+            sprite = populate(greasy, density)
+            greasy.base = None
+            greasy.backgroundTile = None
+            results["updateDisplay " + label] = summarise(
+                sample(greasy.updateDisplay))
+            greasy.setBackground(tile)
+            results["updateDisplay background " + label] = summarise(
+                sample(greasy.updateDisplay))
+            greasy.setDirtyMode()
+            greasy.updateDisplay()
+            cells = [(r, c) for r, c in greasy.gameGrid
+                     if greasy.getObject(r, c) == 0]
+            def move():
+                start = cells.pop()
+                greasy.addObject(sprite, start[0], start[1])
+                greasy.moveObject(start, cells[-1])
+                greasy.updateDisplay()
+            results["updateDisplay dirty move " + label] = summarise(
+                sample(move))
+            greasy.setDirtyMode(False)
+
+        results["setBackground %dx%d" % (size, size)] = summarise(
+            sample(lambda: greasy.setBackground(tile),
+                   setup=greasy.clearBackgrounds))
+        results["fillEmptyCells %dx%d" % (size, size)] = summarise(
+            sample(lambda: greasy.fillEmptyCells(tile),
+                   setup=greasy.emptyGrid))
+        results["emptyGrid %dx%d" % (size, size)] = summarise(
+            sample(greasy.emptyGrid))
+        # count scans for an ID, so give it a grid full of tile to find
+        greasy.fillEmptyCells(tile)
+        results["count %dx%d" % (size, size)] = summarise(
+            sample(lambda: greasy.gameGrid.count(tile)))
+        results["moveObject %dx%d" % (size, size)] = summarise(
+            sample(lambda: greasy.moveObject((0, 0), (1, 1)), 1000))
+
+    results["text"] = summarise(
+        sample(lambda: greasy.text("Score 1234\nLives 3", (0, 0), None, 20)))
+    results["text glyphs"] = summarise(
+        sample(lambda: greasy.text("Score 1234\nLives 3", (0, 0), None, 20,
+                                   glyphs=True)))
+
+    filename = os.path.join(tempfile.mkdtemp(), "tile.png")
+    pygame.image.save(tile, filename)
+    results["newObject"] = summarise(
+        sample(lambda: greasy.newObject(filename), setup=greasy.assets.clear))
+    results["newObject cached"] = summarise(
+        sample(lambda: greasy.newObject(filename)))
+    return results
+
+def benchmarkPathfindingSummary(size=512):
+    return dict(("pathfinding %dx%d %s" % (size, size, key),
+                 {"mean": value})
+                for key, value in benchmarkPathfinding(size).items())
+
+def report(results, baseline=None):
+    for name in sorted(results):
+        result = results[name]
+        line = "%-45s %9.3f ms" % (name, result["mean"])
+        if "p95" in result:
+            line += "  %8.1f fps  p50 %7.3f  p95 %7.3f  p99 %7.3f" % (
+                result["fps"], result["p50"], result["p95"], result["p99"])
+        if baseline and name in baseline and baseline[name]["mean"]:
+            line += "  %+6.1f%%" % (
+                (result["mean"] / baseline[name]["mean"] - 1) * 100)
+        print line
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Greasy benchmarks")
+    parser.add_argument("--save", help="write the results to a JSON file")
+    parser.add_argument("--compare", help="compare with a saved JSON file")
+    arguments = parser.parse_args()
+    results = benchmarkEngine()
+    results.update(benchmarkPathfindingSummary())
+    baseline = None
+    if arguments.compare:
+        with open(arguments.compare) as source:
+            baseline = json.load(source)
+    report(results, baseline)
+    if arguments.save:
+        with open(arguments.save, "w") as output:
+            json.dump(results, output, indent=1, sort_keys=True)
@@ -0,0 +1,101 @@
+from collections import OrderedDict
+
+def surfaceBytes(surface):
+    """
+    Returns the approximate memory used by a pygame surface's pixels
+    """
+    return surface.get_pitch() * surface.get_height()
+
+class LRUCache(object):
+    """
+    A least-recently-used cache with an optional memory budget. Each entry
+    is given a size when it is added, and the oldest entries are evicted
+    once the total size goes over the budget.
+    """
+    def __init__(self, budget=None, maxItems=None, onEvict=None):
+        self.budget = budget
+        self.maxItems = maxItems
+        # called as onEvict(key, value) when an entry is evicted
+        self.onEvict = onEvict
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value stored under key, marking it as recently used
+        """
+        try:
+            value = self.entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+        self.entries[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value, size=0):
+        """
+        Stores a value, evicting the least recently used entries if the
+        cache is over budget
+        """
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = value
+        self.sizes[key] = size
+        self.used += size
+        self.evict()
+
+    def remove(self, key):
+        """
+        Removes an entry without counting it as an eviction
+        """
+        value = self.entries.pop(key)
+        self.used -= self.sizes.pop(key)
+        return value
+
+    def evict(self):
+        """
+        Evicts entries until the cache is within its budget. The newest
+        entry is never evicted.
+        """
+        while len(self.entries) > 1 and (
+                (self.budget is not None and self.used > self.budget) or
+                (self.maxItems is not None and
+                 len(self.entries) > self.maxItems)):
+            key = next(iter(self.entries))
+            value = self.remove(key)
+            self.evictions += 1
+            if self.onEvict:
+                self.onEvict(key, value)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes = {}
+        self.used = 0
+
+    def hitRate(self):
+        """
+        Returns the fraction of lookups that were hits
+        """
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def stats(self):
+        """
+        Returns a dictionary of the cache counters
+        """
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "used": self.used,
+                "budget": self.budget}
+
+    def __contains__(self, key):
+        return key in self.entries
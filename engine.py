@@ -1,7 +1,23 @@
 import grid as g
 import input as i
 import sound as s
-import pygame, os, math
+import cache as c
+import fonts as f
+import profiler as p
+import layers as l
+import spatial as sp
+import pathfinding as pf
+import world as w
+import snapshot as sn
+import loader as ld
+import analysis as a
+import pygame, os, math, weakref
+from contextlib import contextmanager
+from timeit import default_timer
+
+@contextmanager
+def noTransaction():
+    yield None
 
 class Timer:
     def __init__(self):
@@ -26,10 +42,10 @@ class Timer:
         
         
         """
-        self.timeFinish = pygame.time.get_ticks()()
+        self.timeFinish = pygame.time.get_ticks()
         elapsedTime = self.timeFinish - self.timeStart
         if secs:
-            return elapsedTime / 1000
+            return elapsedTime / 1000.0
         else:
             return elapsedTime
     
@@ -52,16 +68,34 @@ class Timer:
 class Camera():
     def __init__(self,
                  focus,
-                 area):
+                 area,
+                 scale=1.0,
+                 minScale=0.25):
+        """
+        A view onto part of the grid.
+        
+        Parameters
+        ----------
+        focus: tuple
+            (row, column) of the cell at the centre of the view
+        area: tuple
+            (across, down) size of the view in cells at a scale of 1
+        scale: float, optional, default=1.0
+            zoom level, 2.0 draws every cell at twice its size
+        minScale: float, optional, default=0.25
+            the furthest the camera can zoom out
+        """
         self.focus = focus
         self.area = area
+        self.scale = scale
+        self.minScale = minScale
     
     def zoom(self, amount):
         """
         Positive amount values - zoom in
         Negative amount values - zoom out
         """
-        pass
+        self.scale = max(self.minScale, self.scale + amount)
     
     def move(self, cell):
         self.focus = cell
@@ -69,6 +103,111 @@ class Camera():
     def rotate(self, amount):
         pass
 
+    def visibleCells(self):
+        """
+        Returns the (across, down) number of cells in view at the current
+        scale
+        """
+        return (int(math.ceil(self.area[0] / float(self.scale))),
+                int(math.ceil(self.area[1] / float(self.scale))))
+
+    def origin(self, rows, columns):
+        """
+        Returns the (row, column) of the top left cell in view, keeping the
+        view inside a grid of the given size
+        """
+        across, down = self.visibleCells()
+        row = max(0, min(self.focus[0] - across // 2, rows - across))
+        column = max(0, min(self.focus[1] - down // 2, columns - down))
+        return (row, column)
+
+class SpriteSheet():
+    def __init__(self, image, frameSize):
+        """
+        Slices one image into equally sized frames, read left to right and
+        top to bottom. Frames are subsurfaces, so they share the image's
+        pixels rather than copying them.
+        
+        Parameters
+        ----------
+        image: pygame surface
+            the whole spritesheet
+        frameSize: tuple
+            (width, height) of one frame
+        """
+        self.image = image
+        self.frameSize = frameSize
+        self.frames = []
+        width, height = frameSize
+        for y in range(0, image.get_height() - height + 1, height):
+            for x in range(0, image.get_width() - width + 1, width):
+                self.frames.append(image.subsurface((x, y, width, height)))
+        self.animations = {}
+
+    def addAnimation(self, name, frames, fps, loop=True):
+        """
+        Stores an animation made of the given frame indices
+        """
+        animation = Animation([self.frames[n] for n in frames], fps, loop)
+        self.animations[name] = animation
+        return animation
+
+class Animation():
+    def __init__(self, frames, fps, loop=True):
+        self.frames = frames
+        self.fps = fps
+        self.loop = loop
+
+    def frameIndex(self, elapsed):
+        """
+        Returns the index of the frame showing elapsed milliseconds after
+        the animation started
+        """
+        index = int(elapsed * self.fps // 1000)
+        if self.loop:
+            return index % len(self.frames)
+        return min(index, len(self.frames) - 1)
+
+    def frameAt(self, elapsed):
+        return self.frames[self.frameIndex(elapsed)]
+
+class Animator():
+    def __init__(self):
+        """
+        Advances the animations of many characters in one pass per frame
+        """
+        self.characters = []
+
+    def add(self, character):
+        self.characters.append(character)
+
+    def remove(self, character):
+        self.characters.remove(character)
+
+    def update(self, now, place=None):
+        """
+        Sets the sprite of every playing character to its frame at time
+        now, in milliseconds. place(character, placed) is called for each
+        character whose frame or position has changed, to draw it, where
+        placed is the (position, sprite) it was last drawn with, or None.
+        """
+        for character in self.characters:
+            animation = character.animation
+            if not animation:
+                continue
+            if character.started is None:
+                character.started = now
+            index = animation.frameIndex(now - character.started)
+            position = tuple(character.position)
+            placed = character.placed
+            if index != character.frame or (placed and
+                                            placed[0] != position):
+                character.frame = index
+                character.sprite = animation.frames[index]
+                if place:
+                    place(character, placed)
+                    character.placed = (position, character.sprite)
+
 class Character():
     def __init__(self,
                  starting_position,
@@ -77,14 +216,52 @@ class Character():
         self.sprite = sprite
     
     def move(self, cell):
-        pass
+        self.position = cell
 
 class AnimatedCharacter(Character):
     def __init__(self,
                  starting_position,
                  sprite,
                  spritesheet_size):
-        Character.__init__(starting_position, sprite)
+        """
+        A character whose sprite is played from a spritesheet.
+        
+        Parameters
+        ----------
+        starting_position: tuple
+            (row, column) cell
+        sprite: SpriteSheet or pygame surface
+            a SpriteSheet, which can be shared between characters, or a
+            spritesheet image to slice
+        spritesheet_size: tuple
+            (across, down) number of frames in the image. Ignored if sprite
+            is already a SpriteSheet.
+        """
+        if not isinstance(sprite, SpriteSheet):
+            frameSize = (sprite.get_width() // spritesheet_size[0],
+                         sprite.get_height() // spritesheet_size[1])
+            sprite = SpriteSheet(sprite, frameSize)
+        self.sheet = sprite
+        Character.__init__(self, starting_position, sprite.frames[0])
+        self.animation = None
+        self.started = 0
+        # index of the frame last shown by an Animator, and the
+        # (position, sprite) it was last drawn with
+        self.frame = None
+        self.placed = None
+
+    def play(self, name, now=None):
+        """
+        Starts one of the spritesheet's animations at time now, or at the
+        next Animator update if now is None
+        """
+        self.animation = self.sheet.animations[name]
+        self.started = now
+        self.frame = None
+        self.sprite = self.animation.frames[0]
+
+    def stop(self):
+        self.animation = None
 
 class GreasyEngine():
     def __init__(self,
@@ -96,8 +273,42 @@ class GreasyEngine():
                  title="Greasy Window",
                  fullscreen=False,
                  resizable=False,
-                 icon=None):
+                 icon=None,
+                 assetBudget=64 * 1024 * 1024,
+                 transformBudget=16 * 1024 * 1024,
+                 camera=None,
+                 headless=False):
+        if headless:
+            # render to an offscreen surface with no window or sound device
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+            os.environ['SDL_AUDIODRIVER'] = 'dummy'
+        self.headless = headless
         self.gameGrid = g.Grid(rows, columns)
+        self.assets = c.LRUCache(budget=assetBudget)
+        self.assetNames = weakref.WeakKeyDictionary()
+        self.fonts = f.FontCache()
+        self.transforms = c.LRUCache(budget=transformBudget)
+        self.rotatedFrom = weakref.WeakKeyDictionary()
+        self.flippedFrom = weakref.WeakKeyDictionary()
+        self.scaledFrom = weakref.WeakKeyDictionary()
+        # collision masks, dropped along with their surfaces
+        self.masks = weakref.WeakKeyDictionary()
+        self.profiler = p.FrameProfiler()
+        # hot-path counters, None unless enableStats is called
+        self.stats = None
+        self.statsOverlay = False
+        self.overlaySurface = None
+        self.animator = Animator()
+        self.layers = []
+        self.layerGrids = {}
+        self.spatial = sp.SpatialHash()
+        self.pathfinders = []
+        self.streamer = None
+        self.loader = None
+        self.running = False
+        self.events = []
+        self.frameCount = 0
+        self.skippedUpdates = 0
         self.input = i.InputHandler()
         self.sound = s.SoundHandler()
         self.timer = Timer()
@@ -107,16 +318,38 @@ class GreasyEngine():
         self.rows = rows
         if centred:
             os.environ['SDL_VIDEO_CENTERED'] = '1'
-        else:
+        elif not headless:
             os.environ['SDL_VIDEO_WINDOW_POS'] = str(windowPosition[0]) + "," + str(windowPosition[1])
         pygame.init()
-        self.screen = pygame.display.set_mode((imageWidth * rows,
-                                               imageHeight * columns))
+        # with a camera the window only needs to show its area
+        self.camera = camera
+        self.cameraView = None
+        self.scaledTiles = c.LRUCache(maxItems=4096)
+        if camera:
+            windowSize = (imageWidth * camera.area[0],
+                          imageHeight * camera.area[1])
+        else:
+            windowSize = (imageWidth * rows, imageHeight * columns)
+        self.screen = pygame.display.set_mode(windowSize)
         if icon != None:
             self.setIcon(icon)
         pygame.display.set_caption(title)
         self.base = None
+        self.backgroundTile = None
+        self.backgroundCache = {}
+        self.backgrounds = {}
         self.backgroundColour = backgroundColour
+        # dirty rectangle mode
+        self.dirtyMode = False
+        self.dirtyCells = set()
+        self.dirtyRectCount = 0
+        self.redrawAll = True
+        self.textCells = set()
+        # chunk rendering, see setChunkRendering
+        self.chunkSize = 0
+        self.chunks = {}
+        self.dirtyChunks = set()
+        self.chunkBase = None
         self.fill()
 
     ##### OBJECTS #####
@@ -140,12 +373,21 @@ class GreasyEngine():
             gameGrid = self.gameGrid
         # set gameGrid[target] to gameGrid[start]
         currentItem = gameGrid.getItem(start[0], start[1])
-        gameGrid.setItem(replacement, start[0], start[1])
-        gameGrid.setItem(currentItem, target[0], target[1])
+        with self.transaction(gameGrid):
+            gameGrid.setItem(replacement, start[0], start[1])
+            gameGrid.setItem(currentItem, target[0], target[1])
+        for entity in self.spatial.queryPoint(tuple(start)):
+            self.spatial.move(entity, tuple(target))
+        self.markDirty(start[0], start[1], gameGrid)
+        self.markDirty(target[0], target[1], gameGrid)
 
-    def newObject(self, filename, alpha=False, colourkey=None, resize=True):
+    def newObject(self, filename, alpha=False, colourkey=None, resize=True,
+                  cache=True):
         """
-        Returns a new pygame surface.
+        Returns a new pygame surface. Loaded images are kept in self.assets,
+        so later calls with the same arguments return the same surface
+        without decoding the file again. Copy the surface before drawing
+        on it.
         
         Parameters
         ----------
@@ -157,16 +399,50 @@ class GreasyEngine():
             (R,G,B) colourkey
         resize: bool, optional, default=True
             resize the surface to the size of the cells
+        cache: bool, optional, default=True
+            look the image up in, and store it in, the asset cache
+        """
+        key = self.assetKey(filename, alpha, colourkey, resize)
+        if cache:
+            image = self.assets.get(key)
+            if image is not None:
+                return image
+
+        if self.stats:
+            start = default_timer()
+        image = self.prepareImage(pygame.image.load(filename), key, cache)
+        if self.stats:
+            self.stats.count("assetLoads", 1,
+                             (default_timer() - start) * 1000)
+        return image
+
+    def assetKey(self, filename, alpha=False, colourkey=None, resize=True):
+        """
+        Returns the asset cache key for newObject's arguments
+        """
+        if colourkey != None:
+            colourkey = tuple(colourkey)
+        if resize:
+            size = (self.imageWidth, self.imageHeight)
+        else:
+            size = None
+        return (filename, alpha, colourkey, size)
+
+    def prepareImage(self, image, key, cache=True):
         """
+        Converts a freshly decoded image for the display, resizes it and
+        stores it under an assetKey. Must be called on the main thread.
+        """
+        filename, alpha, colourkey, size = key
         if alpha:
             # TODO: implement working colourkey mode
-            image = pygame.image.load(filename).convert_alpha()
+            image = image.convert_alpha()
             if colourkey != None:
                 image.set_colorkey(colourkey)
         else:
-            image = pygame.image.load(filename).convert()
+            image = image.convert()
         
-        if resize:
+        if size:
             size = image.get_size()
             if size[0] != self.imageWidth or size[1] != self.imageHeight:
                 if size[0] != self.imageWidth:
@@ -177,9 +453,47 @@ class GreasyEngine():
                     newHeight = self.imageHeight
                 else:
                     newHeight = size[1]
-                image = self.resizeObject(image, newWidth, newHeight)
+                image = self.resizeObject(image, newWidth, newHeight,
+                                          cache=False)
+        if cache:
+            self.assets.put(key, image, c.surfaceBytes(image))
+        self.assetNames[image] = key
         return image
 
+    def preload(self, filenames, alpha=False, colourkey=None, resize=True):
+        """
+        Loads a list of images into the asset cache
+        """
+        for filename in filenames:
+            self.newObject(filename, alpha, colourkey, resize)
+
+    def startLoader(self, workers=4, batch=4):
+        """
+        Creates self.loader, an AssetLoader decoding images and sounds on
+        workers background threads. run converts up to batch loaded assets
+        each frame; call updateLoader yourself when not using run. Returns
+        the loader.
+        """
+        if self.loader is None:
+            self.loader = ld.AssetLoader(self, workers, batch)
+        return self.loader
+
+    def updateLoader(self):
+        """
+        Finishes a batch of background loaded assets. Called every frame by
+        run.
+        """
+        if self.loader:
+            self.loader.update()
+
+    def newSpriteSheet(self, filename, frameSize, alpha=True, colourkey=None):
+        """
+        Returns a SpriteSheet for an image file. The image is loaded through
+        the asset cache, so characters using the same file share one atlas.
+        """
+        image = self.newObject(filename, alpha, colourkey, resize=False)
+        return SpriteSheet(image, frameSize)
+
     def addObject(self, item, row, column, gameGrid=None):
         """
         Adds a pygame surface to the grid
@@ -202,6 +516,83 @@ class GreasyEngine():
             Location out of bounds" % str(item)
             return None
         gameGrid.setItem(item, row, column)
+        self.markDirty(row, column, gameGrid)
+
+    def transaction(self, gameGrid=None):
+        """
+        Returns a grid's transaction, so changes to several cells are one
+        change event and one undo step, or a context that does nothing for
+        grids without transactions, such as a StreamedGrid
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        transaction = getattr(gameGrid, "transaction", None)
+        if transaction is None:
+            return noTransaction()
+        return transaction()
+
+    def placeCharacter(self, character, placed=None, gameGrid=None):
+        """
+        Puts a character's current sprite in the grid at its position.
+        placed is the (position, sprite) the character was last put in the
+        grid with. If it has moved since and its old cell still holds that
+        sprite, the sprite is moved with moveObject, emptying the old cell.
+        """
+        row, column = character.position
+        with self.transaction(gameGrid):
+            if placed:
+                (oldRow, oldColumn), sprite = placed
+                if ((oldRow, oldColumn) != (row, column) and
+                    0 <= oldRow < self.rows and 0 <= oldColumn < self.columns
+                    and self.getObject(oldRow, oldColumn, gameGrid) is sprite):
+                    self.moveObject((oldRow, oldColumn), (row, column),
+                                    gameGrid=gameGrid)
+            self.addObject(character.sprite, row, column, gameGrid)
+
+    def newPathfinder(self, gameGrid=None, emptyValue=0):
+        """
+        Returns a Pathfinder for a grid, treating cells containing
+        emptyValue as passable. The engine keeps it up to date as cells are
+        changed through addObject, moveObject, emptyCell, etc.
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        pathfinder = pf.Pathfinder(gameGrid, emptyValue)
+        self.pathfinders.append(pathfinder)
+        return pathfinder
+
+    def watchGrid(self, gameGrid=None):
+        """
+        Subscribes to a grid's changes, so cells changed without the
+        engine's mutators, such as by game rules calling setItem directly,
+        are still redrawn and seen by pathfinders
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        def gridChanged(changedGrid, changes):
+            if changes is None:
+                self.markAll(changedGrid)
+                return None
+            for r, c, old, new in changes:
+                self.markDirty(r, c, changedGrid)
+        gameGrid.subscribe(gridChanged)
+        return gridChanged
+
+    def trackObject(self, entity, cell):
+        """
+        Adds an entity to the spatial index at cell. The entity is a handle
+        of the game's own, such as a Character, rather than the contents of
+        the cell, since many cells can hold the same surface. Entities are
+        moved along with their cell's contents by moveObject and
+        arrowMoveObject, and can be found with self.spatial's point, rect,
+        radius and nearest queries. Returns the entity.
+        """
+        self.spatial.insert(entity, tuple(cell))
+        return entity
+
+    def untrackObject(self, entity):
+        if entity in self.spatial:
+            self.spatial.remove(entity)
 
     def getObject(self, row, column, gameGrid=None):
         """
@@ -217,10 +608,8 @@ class GreasyEngine():
         """
         if not gameGrid:
             gameGrid = self.gameGrid
-        for r, c in gameGrid:
-            currentCell = gameGrid.getItem(r, c)
-            if currentCell == emptyValue:
-                self.addObject(item, r, c, gameGrid=gameGrid)
+        if gameGrid.fillEmpty(item, emptyValue):
+            self.markAll(gameGrid)
     
     def emptyCell (self, row, column, gameGrid=None, emptyValue=0):
         """
@@ -236,8 +625,8 @@ class GreasyEngine():
         """
         if not gameGrid:
             gameGrid = self.gameGrid
-        for r, c in gameGrid:
-            self.emptyCell(r, c, gameGrid=gameGrid, emptyValue=emptyValue)
+        gameGrid.clear(emptyValue)
+        self.markAll(gameGrid)
     
     def limitValue(self, value, lowerLimit, upperLimit):
         """
@@ -264,7 +653,149 @@ class GreasyEngine():
         else:
             return False
 
+    def markDirty(self, row, column, gameGrid=None):
+        """
+        Records that a cell of self.gameGrid or of a layer has changed and
+        must be redrawn by the next dirty rectangle or camera update
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        for pathfinder in self.pathfinders:
+            if pathfinder.grid is gameGrid:
+                pathfinder.cellChanged(row, column)
+        if gameGrid is not self.gameGrid:
+            layer = self.layerGrids.get(id(gameGrid))
+            if not layer:
+                return None
+            layer.invalidate()
+        elif self.chunkSize:
+            self.dirtyChunks.add((row // self.chunkSize,
+                                  column // self.chunkSize))
+        if not (self.dirtyMode or self.camera):
+            return None
+        self.dirtyCells.add((row, column))
+
+    def markAll(self, gameGrid=None):
+        """
+        Records that the whole of self.gameGrid, or of a layer, must be
+        redrawn
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        for pathfinder in self.pathfinders:
+            if pathfinder.grid is gameGrid:
+                pathfinder.reset()
+        if gameGrid is not self.gameGrid:
+            layer = self.layerGrids.get(id(gameGrid))
+            if not layer:
+                return None
+            layer.invalidate()
+        else:
+            self.dirtyChunks.update(self.chunks)
+        self.redrawAll = True
+
+    def cellRect(self, row, column):
+        """
+        Returns the pygame Rect covered by a cell on the screen
+        """
+        return pygame.Rect(row * self.imageWidth, column * self.imageHeight,
+                           self.imageWidth, self.imageHeight)
+
     ##### TRANSFORM #####
+    def transform(self, surface, operation, *parameters):
+        """
+        Returns a transformed copy of a surface, reusing the result of any
+        earlier call with the same surface, operation and parameters.
+        
+        Parameters
+        ----------
+        surface: pygame surface
+            surface to transform
+        operation: string
+            "flip", "scale", "rotate" or "rotateCell", which rotates and
+            then crops the result to the size of the original
+        parameters: any
+            (vertical, horizontal) for flip, (width, height) for scale and
+            (angle,) for the rotations
+        """
+        key = (id(surface), operation) + parameters
+        cached = self.transforms.get(key)
+        if cached is None:
+            if operation == "flip":
+                result = pygame.transform.flip(surface, *parameters)
+            elif operation == "scale":
+                result = pygame.transform.scale(surface, parameters)
+            elif operation == "rotate":
+                result = pygame.transform.rotate(surface, parameters[0])
+            elif operation == "rotateCell":
+                rotated = self.transform(surface, "rotate", parameters[0])
+                rect = surface.get_rect(center=rotated.get_rect().center)
+                result = rotated.subsurface(rect)
+            else:
+                raise ValueError("unknown transform %s" % operation)
+            # keep a reference to the source so its id can't be reused
+            cached = (surface, result)
+            self.transforms.put(key, cached, c.surfaceBytes(result))
+        return cached[1]
+
+    def rotateSurface(self, surface, angle, keepSize=False):
+        """
+        Rotates a surface through the transform cache. Rotating a surface
+        that is itself a rotation starts again from the original, so
+        repeated rotations don't blur or grow.
+        """
+        if surface in self.rotatedFrom:
+            original, previousAngle = self.rotatedFrom[surface]
+            surface = original
+            angle = angle + previousAngle
+        angle = angle % 360
+        if keepSize:
+            rotated = self.transform(surface, "rotateCell", angle)
+        else:
+            rotated = self.transform(surface, "rotate", angle)
+        self.rotatedFrom[rotated] = (surface, angle)
+        return rotated
+
+    def flipSurface(self, surface, vertical, horizontal):
+        """
+        Flips a surface through the transform cache. Flipping a surface
+        that is itself a flip starts again from the original, so flipping
+        back and forth reuses the same two surfaces.
+        """
+        if surface in self.flippedFrom:
+            original, wasVertical, wasHorizontal = self.flippedFrom[surface]
+            surface = original
+            vertical = bool(vertical) != wasVertical
+            horizontal = bool(horizontal) != wasHorizontal
+        vertical = bool(vertical)
+        horizontal = bool(horizontal)
+        if not (vertical or horizontal):
+            return surface
+        flipped = self.transform(surface, "flip", vertical, horizontal)
+        self.flippedFrom[flipped] = (surface, vertical, horizontal)
+        return flipped
+
+    def scaleSurface(self, surface, width, height):
+        """
+        Scales a surface through the transform cache, always from the
+        original of a surface that is itself a scaled copy
+        """
+        surface = self.scaledFrom.get(surface, surface)
+        if surface.get_size() == (width, height):
+            return surface
+        scaled = self.transform(surface, "scale", width, height)
+        self.scaledFrom[scaled] = surface
+        return scaled
+
+    def prebakeRotations(self, surface, count=8, keepSize=False):
+        """
+        Fills the transform cache with count evenly spaced rotations of a
+        surface, and returns them in order starting from 0 degrees
+        """
+        step = 360.0 / count
+        return [self.rotateSurface(surface, n * step, keepSize)
+                for n in range(count)]
+
     def flipObject(self, object, vertical, horizontal):
         """
         Flips a pygame surface vertically, horizontally, or both.
@@ -274,39 +805,43 @@ class GreasyEngine():
             row = object[0]
             column = object[1]
         except TypeError:
-            flipped = pygame.transform.flip(object, vertical, horizontal)
+            flipped = self.flipSurface(object, vertical, horizontal)
             return flipped
-        flipped = pygame.transform.flip(self.getObject(row, column), vertical,
-                                        horizontal)
+        flipped = self.flipSurface(self.getObject(row, column), vertical,
+                                   horizontal)
         self.addObject(flipped, row, column)
         return flipped
 
-    def resizeObject(self, object, width, height):
+    def resizeObject(self, object, width, height, cache=True):
         """
-        Scales a pygame surface
+        Scales a pygame surface. If cache is False the transform cache is
+        bypassed, which suits surfaces that are only scaled once.
         """
         try:
             row = object[0]
             column = object[1]
         except TypeError:
-            scaled = pygame.transform.scale(object, (width, height))
+            if not cache:
+                return pygame.transform.scale(object, (width, height))
+            scaled = self.scaleSurface(object, width, height)
             return scaled
-        scaled = pygame.transform.scale(self.getObject(row, column),
-                                        (width, height))
+        scaled = self.scaleSurface(self.getObject(row, column), width, height)
         self.addObject(scaled, row, column)
         return scaled
 
     def rotateObject(self, object, angle):
         """
-        Rotates a pygame surface
+        Rotates a pygame surface. Rotating a grid reference keeps the cell's
+        surface the same size, cropping the corners of the rotated image.
         """
         try:
             row = object[0]
             column = object[1]
         except TypeError:
-            rotated = pygame.transform.rotate(object, angle)
+            rotated = self.rotateSurface(object, angle)
             return rotated
-        rotated = pygame.transform.rotate(self.getObject(row, column), angle)
+        rotated = self.rotateSurface(self.getObject(row, column), angle,
+                                     keepSize=True)
         self.addObject(rotated, row, column)
         return rotated
     
@@ -320,10 +855,221 @@ class GreasyEngine():
         """
         return item.get_at(pixel)
 
+    def getPixelColours(self, item, pixels=None):
+        """
+        Returns the RGBA colours of a list of pixels, or of the whole
+        surface, as a numpy array. See analysis.readPixels.
+        """
+        return a.readPixels(item, pixels)
+
+    def getMask(self, item, threshold=127):
+        """
+        Returns the cached collision mask of a surface. Call forgetMask
+        after drawing on a surface that already has one.
+        """
+        return a.collisionMask(item, threshold, self.masks)
+
+    def forgetMask(self, item):
+        self.masks.pop(item, None)
+
+    def objectsCollide(self, item, cell, other, otherCell):
+        """
+        Returns True if the solid pixels of two surfaces drawn in two cells
+        overlap, using their cached collision masks
+        """
+        position = (cell[0] * self.imageWidth, cell[1] * self.imageHeight)
+        otherPosition = (otherCell[0] * self.imageWidth,
+                         otherCell[1] * self.imageHeight)
+        return a.overlap(item, position, other, otherPosition,
+                         self.masks) is not None
+
+    ##### LAYERS #####
+    def addLayer(self, name, static=False):
+        """
+        Adds a named layer, drawn above the main grid and any earlier
+        layers, and returns it. Objects are added to a layer by passing
+        layer.grid as the gameGrid argument of addObject, moveObject, etc.
+        
+        Parameters
+        ----------
+        name: string
+            layer name
+        static: bool, optional, default=False
+            cache the layer as one surface, redrawing it only when one of
+            its cells changes. Suits terrain and other rarely changing
+            layers.
+        """
+        layer = l.Layer(name, self.rows, self.columns,
+                        self.imageWidth, self.imageHeight, static)
+        self.layers.append(layer)
+        self.layerGrids[id(layer.grid)] = layer
+        self.redrawAll = True
+        return layer
+
+    def getLayer(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        return None
+
+    def removeLayer(self, name):
+        layer = self.getLayer(name)
+        if layer:
+            self.layers.remove(layer)
+            del self.layerGrids[id(layer.grid)]
+            self.redrawAll = True
+
+    ##### WORLDS #####
+    def streamWorld(self, filename, radius=1, maxChunks=64, writable=False):
+        """
+        Replaces self.gameGrid with a StreamedGrid reading a world file,
+        loading the chunks around the camera focus in the background. The
+        tiles named in the world's manifest are loaded with newObject.
+        Streamed worlds are drawn through a camera; grid-wide operations
+        such as fillEmptyCells aren't supported on them.
+        
+        Parameters
+        ----------
+        filename: string
+            world file made with world.createWorld or world.saveWorld
+        radius: int, optional, default=1
+            chunks either side of the focus chunk to keep loaded
+        maxChunks: int, optional, default=64
+            most chunks held in memory
+        writable: bool, optional, default=False
+            write changed chunks back to the file
+        """
+        world = w.World(filename, writable)
+        tiles = [0]
+        for entry in world.manifest:
+            if isinstance(entry, list):
+                tiles.append(self.newObject(*entry))
+            else:
+                tiles.append(self.newObject(entry))
+        if self.streamer:
+            self.streamer.close()
+        self.streamer = w.StreamedGrid(world, tiles, maxChunks,
+                                       self.loadedKey)
+        self.streamRadius = radius
+        self.gameGrid = self.streamer
+        self.rows = world.rows
+        self.columns = world.columns
+        self.redrawAll = True
+        return self.streamer
+
+    def updateStream(self, maxApply=2):
+        """
+        Requests the world chunks around the camera focus and adds up to
+        maxApply loaded chunks to the grid. Called every frame by run.
+        """
+        if not (self.streamer and self.camera):
+            return None
+        if self.streamer.update(self.camera.focus, self.streamRadius,
+                                maxApply):
+            self.redrawAll = True
+
+    def loadedKey(self, item):
+        """
+        Returns the asset cache key an image was loaded with, or None
+        """
+        try:
+            return self.assetNames.get(item)
+        except TypeError:
+            return None
+
+    def assetName(self, item):
+        """
+        Returns the newObject arguments an image was loaded with, as a list
+        """
+        try:
+            filename, alpha, colourkey, size = self.assetNames[item]
+        except (KeyError, TypeError):
+            raise ValueError("%r was not loaded with newObject" % item)
+        return [filename, alpha, colourkey, size is not None]
+
+    def saveGrid(self, filename, gameGrid=None, compress=False, base=None,
+                 wait=False):
+        """
+        Saves a grid to a snapshot file on a background thread, which is
+        returned. Surfaces in the grid must have been loaded with
+        newObject.
+        
+        Parameters
+        ----------
+        filename: string
+            snapshot filename
+        gameGrid: Greasy Grid, optional, default=self.gameGrid
+            grid to save
+        compress: bool, optional, default=False
+            zlib compress the cells
+        base: array, optional, default=None
+            cells from snapshot.copyCells. If given, only the cells that
+            have changed since are saved, for autosaves and undo.
+        wait: bool, optional, default=False
+            wait for the file to be written before returning
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        thread = sn.saveGridAsync(filename, gameGrid, self.assetName,
+                                  compress, base)
+        if wait:
+            thread.join()
+        return thread
+
+    def loadGrid(self, filename, gameGrid=None):
+        """
+        Loads a snapshot file into a grid, loading its images with
+        newObject
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        sn.loadGrid(filename, lambda entry: self.newObject(*entry), gameGrid)
+        self.markAll(gameGrid)
+        return gameGrid
+
     ##### DISPLAY #####
+    def setCamera(self, camera):
+        """
+        Sets the camera used to draw the grid, or None to draw all of it.
+        The window size is not changed.
+        """
+        self.camera = camera
+        self.cameraView = None
+        self.dirtyCells = set()
+        self.textCells = set()
+        self.redrawAll = True
+
+    def setDirtyMode(self, enabled=True):
+        """
+        Turns dirty rectangle rendering on or off. In dirty mode
+        updateDisplay only redraws the cells changed through the engine's
+        mutators since the previous frame and updates just those areas of
+        the display. The number of rects updated by the last frame is
+        stored in self.dirtyRectCount.
+        """
+        self.dirtyMode = enabled
+        self.dirtyCells = set()
+        self.textCells = set()
+        self.redrawAll = True
+
+    def setChunkRendering(self, chunkSize=16):
+        """
+        Turns chunk rendering on, or off if chunkSize is 0. Full redraws of
+        self.gameGrid then compose the background and sprites of each
+        chunkSize x chunkSize block of cells into a cached surface, and
+        blit one surface per chunk. A chunk is only recomposed after one
+        of its cells changes through the engine's mutators. Like dirty
+        mode, this assumes that sprites fit inside their cells.
+        """
+        self.chunkSize = chunkSize
+        self.chunks = {}
+        self.dirtyChunks = set()
+        self.chunkBase = None
+        self.redrawAll = True
+
     def setIcon(self, icon, alpha=False):
         """
-        Sets the window icon
+        Sets the window icon. Filenames are loaded through the asset cache.
         """
         try:
             pygame.display.set_icon(icon)
@@ -331,25 +1077,70 @@ class GreasyEngine():
             icon = self.newObject(icon, alpha)
             pygame.display.set_icon(icon)
     
-    def setBackground(self, background, dest=None, empty=0):
+    def setBackground(self, background, dest=None, empty=0, name=None):
         """
-        Creates a tiled background from one pygame surface
+        Creates a tiled background from one pygame surface. The composed
+        background is cached, keyed by the tile surface, grid size and
+        window size, so setting the same background again is free.
+        
+        Parameters
+        ----------
+        background: pygame surface
+            tile to repeat across the grid
+        dest: pygame surface, optional, default=self.screen
+            surface whose size the background should match
+        empty: any, optional, default=0
+            if background is equal to empty, the background is left blank
+        name: string, optional, default=None
+            also store the background under a name for useBackground
         """
         if not dest:
             dest = self.screen
-        self.base = pygame.display.set_mode(dest.get_size())
-        backgroundGrid = g.Grid(self.rows, self.columns)
-        self.fillEmptyCells(background, gameGrid=backgroundGrid)
-            
-        # blit tiled background image on background surface
-        for r, c in backgroundGrid:
-            x = r * self.imageWidth
-            y = c * self.imageHeight
-            currentItem = backgroundGrid.getItem(r, c)
-            if currentItem != empty:
-                self.base.blit(currentItem, (x, y))
-        self.base = self.base.copy()
- 
+        size = dest.get_size()
+        key = (id(background), self.rows, self.columns,
+               self.imageWidth, self.imageHeight, size)
+        cached = self.backgroundCache.get(key)
+        if cached:
+            base = cached[1]
+        else:
+            base = pygame.Surface(size).convert()
+            base.fill(self.backgroundColour)
+            # blit tiled background image on background surface
+            if background != empty:
+                rows = min(self.rows, -(-size[0] // self.imageWidth))
+                columns = min(self.columns, -(-size[1] // self.imageHeight))
+                for r in range(rows):
+                    for c in range(columns):
+                        base.blit(background, (r * self.imageWidth,
+                                               c * self.imageHeight))
+            # keep a reference to the tile so its id can't be reused
+            self.backgroundCache[key] = (background, base)
+        if name:
+            self.backgrounds[name] = (background, base)
+        self.base = base
+        self.backgroundTile = background
+        self.redrawAll = True
+
+    def useBackground(self, name):
+        """
+        Switches to a background previously stored with setBackground
+        """
+        try:
+            background, base = self.backgrounds[name]
+        except KeyError:
+            print "useBackground: no background named", name
+            return None
+        self.base = base
+        self.backgroundTile = background
+        self.redrawAll = True
+
+    def clearBackgrounds(self):
+        """
+        Empties the background cache, keeping the current background
+        """
+        self.backgroundCache = {}
+        self.backgrounds = {}
+
     def fill(self, screen=None, colour=None):
         """
         Fills the screen with a single colour
@@ -366,28 +1157,405 @@ class GreasyEngine():
              antialias=False,
              colour=(0,0,0),
              newlinePad=5,
-             screen=None):
+             screen=None,
+             glyphs=False):
         """
-        Creates a pygame surface containing text and displays it.
+        Creates a pygame surface containing text and displays it. Returns
+        a list of the rects drawn. Fonts and rendered lines are cached in
+        self.fonts. If glyphs is True, each line is drawn from cached
+        glyphs instead, which suits text that changes every frame.
         """
         if not screen:
             screen = self.screen
         x = location[0]
         y = location[1]
-        font = pygame.font.Font(font, fontSize)
+        currentFont = self.fonts.getFont(font, fontSize)
         lines = string.split("\n")
         counter = 0
         height = 0
+        rects = []
         for line in lines:
-            fontSurface = font.render(line, antialias, colour).convert()
             if counter == 0:
-                screen.blit(fontSurface, location)
+                position = location
             else:
                 newY = y * counter + newlinePad + height
-                screen.blit(fontSurface, (x, newY))
-            height = font.size(line)[1] + height + newlinePad
+                position = (x, newY)
+            if glyphs:
+                rects.append(self.fonts.blitGlyphs(screen, line, position,
+                                                   font, fontSize,
+                                                   antialias, colour))
+            else:
+                fontSurface = self.fonts.renderLine(line, font, fontSize,
+                                                    antialias, colour)
+                rects.append(screen.blit(fontSurface, position))
+            height = currentFont.size(line)[1] + height + newlinePad
             counter += 1
+        return rects
+
+    def cellsInRect(self, rect):
+        """
+        Returns the set of (row, column) cells overlapped by a rect on the
+        screen, taking the camera into account
+        """
+        if self.camera and self.cameraView:
+            originRow, originColumn, width, height = self.cameraView
+        else:
+            originRow, originColumn = 0, 0
+            width, height = self.imageWidth, self.imageHeight
+        rows = self.gameGrid.rows
+        columns = self.gameGrid.columns
+        firstRow = self.limitValue(originRow + rect.left // width,
+                                   0, rows-1)
+        lastRow = self.limitValue(originRow + (rect.right - 1) // width,
+                                  0, rows-1)
+        firstColumn = self.limitValue(originColumn + rect.top // height,
+                                      0, columns-1)
+        lastColumn = self.limitValue(originColumn + (rect.bottom - 1) // height,
+                                     0, columns-1)
+        cells = set()
+        for r in range(firstRow, lastRow + 1):
+            for c in range(firstColumn, lastColumn + 1):
+                cells.add((r, c))
+        return cells
+
+    def markText(self, rects):
+        """
+        Records the cells covered by text so that dirty mode restores them
+        on the next frame
+        """
+        if not (self.dirtyMode or self.camera):
+            return None
+        for rect in rects:
+            self.textCells |= self.cellsInRect(rect)
+
+    def updateDirty(self, gameGrid, dest, empty=0):
+        """
+        Redraws only the dirty cells, restoring each one from the background
+        before blitting its contents. Returns the list of rects redrawn.
+        """
+        # cells covered by last frame's text must be restored as well
+        cells = self.dirtyCells | self.textCells
+        if self.stats:
+            start = default_timer()
+        rects = []
+        blits = 0
+        for r, c in cells:
+            rect = self.cellRect(r, c)
+            if self.base:
+                dest.blit(self.base, rect, rect)
+            else:
+                dest.fill(self.backgroundColour, rect)
+            currentItem = gameGrid.getItem(r, c)
+            if currentItem != empty:
+                dest.blit(currentItem, rect)
+                blits += 1
+            for layer in self.layers:
+                layer.drawCell(dest, r, c, rect, empty)
+            rects.append(rect)
+        self.dirtyCells = set()
+        self.textCells = set()
+        if self.stats:
+            self.stats.count("blits", blits + len(rects),
+                             (default_timer() - start) * 1000)
+        return rects
        
+    def drawDisplay(self, gameGrid=None,
+                    dest=None,
+                    background=None,
+                    empty=0,
+                    text=None,
+                    text_location=(0,0),
+                    font=None,
+                    fontColour=(0,0,0),
+                    fontAntialias=False,
+                    fontSize=20):
+        """
+        Draws all surfaces to the screen without updating the display. It
+        also optionally displays a tiled background surface. Assumes that
+        all non-zero cells of self.gameGrid contain a pygame Surface. In
+        dirty mode, only the cells changed since the last frame are
+        redrawn, which assumes that sprites fit inside their cells. With a
+        camera, only the cells in view are drawn (see drawCamera).
+        Returns the list of rects drawn, or None if the whole screen was.
+        """
+        if not gameGrid:
+            gameGrid = self.gameGrid
+        if not dest:
+            dest = self.screen
+        if self.camera:
+            if background and background is not self.backgroundTile:
+                self.setBackground(background)
+            rects = self.drawCamera(gameGrid, dest, empty)
+            if text:
+                textRects = self.text(text, text_location, font, fontSize,
+                                      antialias=fontAntialias,
+                                      colour=fontColour)
+                self.markText(textRects)
+                if rects is not None:
+                    rects.extend(textRects)
+            return rects
+        if (self.dirtyMode and not self.redrawAll
+            and gameGrid is self.gameGrid and dest is self.screen
+            and (not background or background is self.backgroundTile)):
+            rects = self.updateDirty(gameGrid, dest, empty)
+            if text:
+                textRects = self.text(text, text_location, font, fontSize,
+                                      antialias=fontAntialias,
+                                      colour=fontColour)
+                self.markText(textRects)
+                rects.extend(textRects)
+            self.dirtyRectCount = len(rects)
+            return rects
+        if background and background is not self.backgroundTile:
+            self.setBackground(background)
+        if self.dirtyMode:
+            self.redrawAll = False
+            self.dirtyCells = set()
+            self.textCells = set()
+            self.dirtyRectCount = 1
+        if self.chunkSize and gameGrid is self.gameGrid:
+            self.drawChunks(gameGrid, dest, empty)
+        else:
+            if not self.base:
+                """Blits the sprites to the screen surface"""
+                self.fill()
+            else:
+                # Blit the cached background to the destination surface,
+                # then blit the sprites on top of it
+                dest.blit(self.base, (0,0))
+            self.drawSprites(gameGrid, dest, empty)
+        if text:
+            self.markText(self.text(text, text_location, font, fontSize,
+                                    antialias=fontAntialias,
+                                    colour=fontColour))
+        return None
+
+    def drawSprites(self, gameGrid, dest, empty=0):
+        """
+        Blits the occupied cells of a grid, then the layers, in one
+        Surface.blits call each
+        """
+        if self.stats:
+            start = default_timer()
+        width = self.imageWidth
+        height = self.imageHeight
+        blits = [(currentItem, (r * width, c * height))
+                 for r, c, currentItem in gameGrid.occupied(empty)]
+        dest.blits(blits, False)
+        for layer in self.layers:
+            layer.draw(dest, empty)
+        if self.stats:
+            self.stats.count("blits", len(blits) + len(self.layers),
+                             (default_timer() - start) * 1000)
+    
+    def renderChunk(self, gameGrid, chunkRow, chunkColumn, surface=None,
+                    empty=0):
+        """
+        Composes the background and sprites of one chunk of cells onto
+        surface, or a new surface, and returns it
+        """
+        size = self.chunkSize
+        width = self.imageWidth
+        height = self.imageHeight
+        firstRow = chunkRow * size
+        firstColumn = chunkColumn * size
+        lastRow = min(firstRow + size, gameGrid.rows)
+        lastColumn = min(firstColumn + size, gameGrid.columns)
+        area = pygame.Rect(firstRow * width, firstColumn * height,
+                           (lastRow - firstRow) * width,
+                           (lastColumn - firstColumn) * height)
+        if surface is None:
+            surface = pygame.Surface(area.size).convert()
+        if self.base:
+            surface.blit(self.base, (0, 0), area)
+        else:
+            surface.fill(self.backgroundColour)
+        items = gameGrid.items
+        cells = gameGrid.cells
+        columns = gameGrid.columns
+        blits = []
+        for r in range(firstRow, lastRow):
+            start = r * columns
+            x = (r - firstRow) * width
+            for c in range(firstColumn, lastColumn):
+                currentItem = items[cells[start + c]]
+                if currentItem != empty:
+                    blits.append((currentItem,
+                                  (x, (c - firstColumn) * height)))
+        surface.blits(blits, False)
+        return surface
+
+    def drawChunks(self, gameGrid, dest, empty=0):
+        """
+        Blits every chunk surface, recomposing those that have changed,
+        then the layers
+        """
+        if self.stats:
+            start = default_timer()
+        if self.base is not self.chunkBase:
+            self.dirtyChunks.update(self.chunks)
+            self.chunkBase = self.base
+        chunks = self.chunks
+        for chunkRow, chunkColumn in self.dirtyChunks:
+            surface = chunks.get((chunkRow, chunkColumn))
+            if surface is not None:
+                self.renderChunk(gameGrid, chunkRow, chunkColumn, surface,
+                                 empty)
+        self.dirtyChunks = set()
+        size = self.chunkSize
+        pixelWidth = size * self.imageWidth
+        pixelHeight = size * self.imageHeight
+        blits = []
+        for chunkRow in range(-(-gameGrid.rows // size)):
+            for chunkColumn in range(-(-gameGrid.columns // size)):
+                surface = chunks.get((chunkRow, chunkColumn))
+                if surface is None:
+                    surface = self.renderChunk(gameGrid, chunkRow,
+                                               chunkColumn, None, empty)
+                    chunks[(chunkRow, chunkColumn)] = surface
+                blits.append((surface, (chunkRow * pixelWidth,
+                                        chunkColumn * pixelHeight)))
+        dest.blits(blits, False)
+        for layer in self.layers:
+            layer.draw(dest, empty)
+        if self.stats:
+            self.stats.count("blits", len(blits) + len(self.layers),
+                             (default_timer() - start) * 1000)
+
+    def scaledTile(self, surface, width, height):
+        """
+        Returns a surface scaled to width x height, caching the result
+        """
+        if surface.get_size() == (width, height):
+            return surface
+        key = (id(surface), width, height)
+        cached = self.scaledTiles.get(key)
+        if cached is None:
+            # keep a reference to the source so its id can't be reused
+            cached = (surface, pygame.transform.scale(surface,
+                                                      (width, height)))
+            self.scaledTiles.put(key, cached)
+        return cached[1]
+
+    def drawCameraCell(self, gameGrid, dest, row, column, empty=0):
+        """
+        Draws one cell of the camera view, over the background. Returns the
+        rect drawn.
+        """
+        originRow, originColumn, width, height = self.cameraView
+        rect = pygame.Rect((row - originRow) * width,
+                           (column - originColumn) * height, width, height)
+        if self.backgroundTile is not None:
+            dest.blit(self.scaledTile(self.backgroundTile, width, height), rect)
+        else:
+            dest.fill(self.backgroundColour, rect)
+        currentItem = gameGrid.getItem(row, column)
+        if currentItem != empty:
+            dest.blit(self.scaledTile(currentItem, width, height), rect)
+        for layer in self.layers:
+            if not layer.visible:
+                continue
+            currentItem = layer.grid.getItem(row, column)
+            if currentItem != empty:
+                dest.blit(self.scaledTile(currentItem, width, height), rect)
+        return rect
+
+    def drawCamera(self, gameGrid, dest, empty=0):
+        """
+        Draws the cells inside the camera's view. If the camera has moved
+        by less than a screen since the last frame, the screen is scrolled
+        and only the newly exposed cells and the cells that changed are
+        drawn. Returns the list of rects drawn, or None if the whole screen
+        was.
+        """
+        camera = self.camera
+        width = int(self.imageWidth * camera.scale)
+        height = int(self.imageHeight * camera.scale)
+        across, down = camera.visibleCells()
+        originRow, originColumn = camera.origin(gameGrid.rows,
+                                                gameGrid.columns)
+        lastView = self.cameraView
+        self.cameraView = (originRow, originColumn, width, height)
+        lastRow = min(originRow + across, gameGrid.rows)
+        lastColumn = min(originColumn + down, gameGrid.columns)
+
+        cells = None
+        scrolled = False
+        if (not self.redrawAll and lastView and lastView[2:] == (width, height)
+            and gameGrid is self.gameGrid and dest is self.screen):
+            rowShift = originRow - lastView[0]
+            columnShift = originColumn - lastView[1]
+            if abs(rowShift) < across and abs(columnShift) < down:
+                # dirty and text cells are in grid coordinates, so they stay
+                # valid after the scroll
+                cells = self.dirtyCells | self.textCells
+                if rowShift or columnShift:
+                    dest.scroll(-rowShift * width, -columnShift * height)
+                    scrolled = True
+                    # a last row or column cut off by the edge of the
+                    # screen was only partly drawn, and scrolls into view
+                    clippedRow = (lastRow - originRow) * width > dest.get_width()
+                    clippedColumn = ((lastColumn - originColumn) * height >
+                                     dest.get_height())
+                    if rowShift > 0:
+                        exposedRows = range(max(lastRow - rowShift -
+                                                clippedRow, originRow),
+                                            lastRow)
+                    else:
+                        exposedRows = range(originRow, originRow - rowShift)
+                    if columnShift > 0:
+                        exposedColumns = range(max(lastColumn - columnShift -
+                                                   clippedColumn,
+                                                   originColumn),
+                                               lastColumn)
+                    else:
+                        exposedColumns = range(originColumn,
+                                               originColumn - columnShift)
+                    for r in exposedRows:
+                        for c in range(originColumn, lastColumn):
+                            cells.add((r, c))
+                    for c in exposedColumns:
+                        for r in range(originRow, lastRow):
+                            cells.add((r, c))
+                    # and any margin past the last cells was scrolled over
+                    right = (lastRow - originRow) * width
+                    bottom = (lastColumn - originColumn) * height
+                    if right < dest.get_width():
+                        dest.fill(self.backgroundColour,
+                                  (right, 0, dest.get_width() - right,
+                                   dest.get_height()))
+                    if bottom < dest.get_height():
+                        dest.fill(self.backgroundColour,
+                                  (0, bottom, dest.get_width(),
+                                   dest.get_height() - bottom))
+        self.dirtyCells = set()
+        self.textCells = set()
+        self.redrawAll = False
+
+        if self.stats:
+            start = default_timer()
+        if cells is None:
+            self.fill(dest)
+            for r in range(originRow, lastRow):
+                for c in range(originColumn, lastColumn):
+                    self.drawCameraCell(gameGrid, dest, r, c, empty)
+            if self.stats:
+                # at least the background of each cell is drawn
+                self.stats.count("blits", (lastRow - originRow) *
+                                 (lastColumn - originColumn),
+                                 (default_timer() - start) * 1000)
+            return None
+        rects = []
+        for r, c in cells:
+            if originRow <= r < lastRow and originColumn <= c < lastColumn:
+                rects.append(self.drawCameraCell(gameGrid, dest, r, c, empty))
+        if self.stats:
+            self.stats.count("blits", len(rects),
+                             (default_timer() - start) * 1000)
+        if scrolled:
+            return None
+        return rects
+
     def updateDisplay(self, gameGrid=None,
                       dest=None,
                       background=None,
@@ -399,50 +1567,35 @@ class GreasyEngine():
                       fontAntialias=False,
                       fontSize=20):
         """
-        Displays all surfaces on the screen. It also optionally displays a
-        tiled background surface. Assumes that all non-zero cells of
-        self.gameGrid contain a pygame Surface
+        Displays all surfaces on the screen. See drawDisplay.
         """
-        if not gameGrid:
-            gameGrid = self.gameGrid
-        if not dest:
-            dest = self.screen
-        self.fill()
-        if not self.base:
-            """Blits the sprites to the screen surface"""
-            if not background:
-                for r, c in gameGrid:
-                    x = r * self.imageWidth
-                    y = c * self.imageHeight
-                    currentItem = gameGrid.getItem(r, c)
-                    if currentItem != empty:
-                        dest.blit(currentItem, (x, y))
-                    if text:
-                        self.text(text, text_location, font, fontSize,
-                                  antialias=fontAntialias, colour=fontColour)
-                pygame.display.update()
-                return None
-            else:
-                self.setBackground(background)
+        rects = self.drawDisplay(gameGrid, dest, background, empty, text,
+                                 text_location, font, fontColour,
+                                 fontAntialias, fontSize)
+        self.flip(rects)
+
+    def flip(self, rects=None):
+        """
+        Updates the display, either the whole of it or just a list of rects.
+        This ends the frame for self.stats, and draws the overlay if it is
+        shown.
+        """
+        if self.stats:
+            if self.statsOverlay:
+                overlayRect = self.drawOverlay()
+                self.markText([overlayRect])
+                if rects is not None:
+                    rects = list(rects) + [overlayRect]
+            start = default_timer()
+        if rects is None:
+            pygame.display.update()
+        else:
+            pygame.display.update(rects)
+        if self.stats:
+            self.stats.count("displayUpdates", 1,
+                             (default_timer() - start) * 1000)
+            self.stats.endFrame()
 
-        # Blit the sprites to the background surface, then blit background
-        # surface to destination surface
-        baseCopy = self.base.copy()            
-        # blit sprites to the background surface
-        for r, c in gameGrid:
-            x = r * self.imageWidth
-            y = c * self.imageHeight
-            currentItem = gameGrid.getItem(r, c)
-            if currentItem !=empty:
-                self.base.blit(currentItem, (x, y))
-        # blit background surface to destination surface
-        dest.blit(self.base, (0,0))
-        self.base = baseCopy.copy()
-        if text:
-            self.text(text, text_location, font, fontSize,
-                      antialias=fontAntialias, colour=fontColour)
-        pygame.display.update()
-    
     def showMessage(self, text, location, font, fontSize, colour=(255,255,255),
                     input=False, secs=None):
         """
@@ -453,10 +1606,9 @@ class GreasyEngine():
         self.text(text, location, font, fontSize, colour=colour)
         pygame.display.update()
         if input:
-            currentEvent = self.input.input()
-            while not self.input.checkInput(currentEvent):
-                currentEvent = self.input.input()
-        if not secs:
+            # sleep until an event arrives rather than polling
+            self.input.wait()
+        if secs:
             self.timer.wait(secs)
     
     ##### HIGH-LEVEL INTERACTION #####
@@ -500,6 +1652,104 @@ class GreasyEngine():
         self.moveObject((x, y), cell)
         return cell
     
+    def run(self, update, render=None, fps=60, tickRate=60, maxUpdates=5):
+        """
+        Runs the game loop until a QUIT event is received, update returns
+        False or stop is called. The simulation advances in fixed steps of
+        1/tickRate seconds, independently of the render rate, which is
+        capped at fps. Each frame's input, update, render and flip times
+        are recorded in self.profiler. Time is read from self.input, so
+        a session recorded with self.input.record can be replayed with
+        self.input.replay, headless and with fps=0 for a soak test.
+        
+        Parameters
+        ----------
+        update: function
+            called as update(dt) once per simulation step, with dt in
+            seconds. The events since the last step are in self.events
+            during the first step of each frame, and self.events is empty
+            during the others, so each event is seen exactly once. Events
+            from a frame that runs no steps are kept for the next step.
+            Events are also passed to any handlers bound with
+            self.input.bind as they arrive.
+        render: function, optional, default=None
+            called as render(alpha) once per frame, where alpha is how far
+            the simulation is between steps. It should draw the frame (for
+            example with drawDisplay) and may return a list of rects to
+            update. If None, drawDisplay is used.
+        fps: int, optional, default=60
+            maximum frames per second. 0 for no cap.
+        tickRate: int, optional, default=60
+            simulation steps per second
+        maxUpdates: int, optional, default=5
+            most simulation steps run in one frame. Steps beyond this are
+            skipped and counted in self.skippedUpdates.
+        """
+        clock = pygame.time.Clock()
+        step = 1000.0 / tickRate
+        accumulator = 0.0
+        self.running = True
+        previous = None
+        # events not yet seen by a step
+        events = []
+        while self.running:
+            self.profiler.startFrame()
+            # time comes from the input source, so replays step the same way
+            now = self.input.ticks()
+            if previous is None:
+                previous = now
+            accumulator += now - previous
+            previous = now
+
+            # input
+            newEvents = self.input.dispatch()
+            for currentEvent in newEvents:
+                if self.input.quit(currentEvent):
+                    self.running = False
+            events.extend(newEvents)
+            self.profiler.mark("input")
+
+            # update
+            updates = 0
+            while accumulator >= step and updates < maxUpdates:
+                self.events = events
+                if update(step / 1000.0) is False:
+                    self.running = False
+                events = []
+                accumulator -= step
+                updates += 1
+            if not updates:
+                self.events = []
+            if accumulator >= step:
+                # too far behind, drop the steps rather than spiral
+                skipped = int(accumulator // step)
+                self.skippedUpdates += skipped
+                accumulator -= skipped * step
+            self.profiler.mark("update")
+
+            # render
+            self.animator.update(now, self.placeCharacter)
+            self.updateStream()
+            self.updateLoader()
+            if render:
+                rects = render(accumulator / step)
+            else:
+                rects = self.drawDisplay()
+            self.profiler.mark("render")
+
+            self.flip(rects)
+            self.profiler.mark("flip")
+            self.profiler.endFrame()
+            self.frameCount += 1
+            if fps:
+                clock.tick(fps)
+
+    def stop(self):
+        """
+        Stops the game loop started by run
+        """
+        self.running = False
+
     def clickCell(self, event):
         """
         Returns a tuple containing (x, y) coordinates of a mouse-clicked
@@ -508,6 +1758,10 @@ class GreasyEngine():
         position = self.input.checkMouseInput(event)
         if not position:
             return None
+        if self.camera and self.cameraView:
+            originRow, originColumn, width, height = self.cameraView
+            return (originRow + position[0] // width,
+                    originColumn + position[1] // height)
         x = math.floor(position[0] / self.imageWidth)
         y = math.floor(position[1] / self.imageHeight)
         return (int(x), int(y))
@@ -518,6 +1772,89 @@ class GreasyEngine():
         """
         return pygame.event.Event(pygame.QUIT)
     
+    ##### INSTRUMENTATION #####
+    def enableStats(self, enabled=True, overlay=False, size=300):
+        """
+        Starts or stops counting blits, display updates, asset loads, font
+        renders and sound decodes in self.stats, a profiler.Instrumentation
+        keeping the last size frames. If overlay is True, flip draws FPS, a
+        frame time graph, the draw calls and cache hit rates in the corner
+        of the screen. While disabled, instrumented code only checks that
+        self.stats is None.
+        """
+        if enabled:
+            self.stats = p.Instrumentation(size)
+        else:
+            self.stats = None
+            overlay = False
+        self.statsOverlay = overlay
+        self.fonts.stats = self.stats
+        self.sound.stats = self.stats
+
+    def cacheStats(self):
+        """
+        Returns a dictionary of the stats of the engine's caches
+        """
+        return {"assets": self.assets.stats(),
+                "transforms": self.transforms.stats(),
+                "scaledTiles": self.scaledTiles.stats(),
+                "fontLines": self.fonts.lines.stats(),
+                "glyphs": self.fonts.glyphs.stats(),
+                "sounds": self.sound.sounds.stats()}
+
+    def exportStats(self, filename):
+        """
+        Writes the recorded frames to a .csv or .json file. JSON exports
+        include the cache stats.
+        """
+        if not self.stats:
+            print "Instrumentation is not enabled"
+            return None
+        self.stats.export(filename, self.cacheStats())
+
+    def drawOverlay(self, dest=None, location=(4, 4), frames=120):
+        """
+        Draws the performance overlay and returns its rect. Text is drawn
+        from cached glyphs, and the panel surface is reused between frames.
+        """
+        if not dest:
+            dest = self.screen
+        stats = self.stats
+        size = (frames + 8, 104)
+        panel = self.overlaySurface
+        if panel is None or panel.get_size() != size:
+            panel = pygame.Surface(size)
+            panel.set_alpha(192)
+            self.overlaySurface = panel
+        panel.fill((0, 0, 0))
+        last = (stats.index - 1) % stats.size
+        lines = ["FPS %.1f  %.1f ms" % (stats.fps(), stats.frameTimes[last]),
+                 "blits %d  updates %d" % (stats.counts["blits"][last],
+                                           stats.counts["displayUpdates"][last]),
+                 "assets %d%%  fonts %d%%" % (self.assets.hitRate() * 100,
+                                             self.fonts.lines.hitRate() * 100),
+                 "sounds %d%%" % (self.sound.sounds.hitRate() * 100)]
+        y = 2
+        for line in lines:
+            rect = self.fonts.blitGlyphs(panel, line, (4, y), None, 14,
+                                         colour=(255, 255, 255))
+            y += rect.height
+        # frame times, with the graph's top at 50ms and a line at 60fps
+        bottom = size[1] - 2
+        scale = 40 / 50.0
+        pygame.draw.line(panel, (96, 96, 96), (4, bottom - 16.7 * scale),
+                         (size[0] - 4, bottom - 16.7 * scale))
+        for x, frameTime in enumerate(stats.recent(stats.frameTimes, frames)):
+            if frameTime > 33.3:
+                colour = (255, 64, 64)
+            elif frameTime > 16.7:
+                colour = (255, 200, 64)
+            else:
+                colour = (64, 255, 64)
+            pygame.draw.line(panel, colour, (4 + x, bottom),
+                             (4 + x, bottom - min(frameTime, 50) * scale))
+        return dest.blit(panel, location)
+
     ##### MISC #####
     def __iter__(self):
         for r, c in self.gameGrid:
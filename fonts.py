@@ -0,0 +1,79 @@
+import cache as c
+from timeit import default_timer
+import pygame
+
+class FontCache(object):
+    """
+    Caches pygame fonts by (font, size) and rendered lines of text by
+    (string, font, size, antialias, colour). Text that changes every frame,
+    such as scores and timers, can instead be drawn from cached glyphs.
+    """
+    def __init__(self, maxFonts=16, lineBudget=4 * 1024 * 1024,
+                 maxGlyphs=2048):
+        self.fonts = c.LRUCache(maxItems=maxFonts)
+        self.lines = c.LRUCache(budget=lineBudget)
+        self.glyphs = c.LRUCache(maxItems=maxGlyphs)
+        # a profiler.Instrumentation counting renders, if enabled
+        self.stats = None
+
+    def getFont(self, font, size):
+        """
+        Returns a pygame font, loading it only on the first request
+        """
+        key = (font, size)
+        currentFont = self.fonts.get(key)
+        if currentFont is None:
+            currentFont = pygame.font.Font(font, size)
+            self.fonts.put(key, currentFont)
+        return currentFont
+
+    def renderLine(self, line, font, size, antialias=False, colour=(0,0,0)):
+        """
+        Returns a converted surface containing one line of text
+        """
+        key = (line, font, size, antialias, tuple(colour))
+        surface = self.lines.get(key)
+        if surface is None:
+            start = default_timer()
+            currentFont = self.getFont(font, size)
+            surface = currentFont.render(line, antialias, colour).convert()
+            self.lines.put(key, surface, c.surfaceBytes(surface))
+            if self.stats:
+                self.stats.count("fontRenders", 1,
+                                 (default_timer() - start) * 1000)
+        return surface
+
+    def renderGlyph(self, character, font, size, antialias=False,
+                    colour=(0,0,0)):
+        """
+        Returns a converted surface containing one character
+        """
+        key = (character, font, size, antialias, tuple(colour))
+        surface = self.glyphs.get(key)
+        if surface is None:
+            start = default_timer()
+            currentFont = self.getFont(font, size)
+            surface = currentFont.render(character, antialias,
+                                         colour).convert()
+            self.glyphs.put(key, surface)
+            if self.stats:
+                self.stats.count("fontRenders", 1,
+                                 (default_timer() - start) * 1000)
+        return surface
+
+    def blitGlyphs(self, dest, line, location, font, size, antialias=False,
+                   colour=(0,0,0)):
+        """
+        Draws a line of text one cached glyph at a time. Kerning is ignored.
+        Returns the rect drawn.
+        """
+        x, y = location
+        blits = []
+        height = 0
+        for character in line:
+            glyph = self.renderGlyph(character, font, size, antialias, colour)
+            blits.append((glyph, (x, y)))
+            x += glyph.get_width()
+            height = max(height, glyph.get_height())
+        dest.blits(blits, False)
+        return pygame.Rect(location[0], y, x - location[0], height)
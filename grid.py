@@ -1,21 +1,639 @@
+from array import array
+from contextlib import contextmanager
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 class Grid(object):
-    def __init__(self, rows, columns):
+    """
+    A grid of cells stored as integer IDs in one contiguous array, row by
+    row. The objects themselves are kept in a side table, so bulk fills,
+    clears and searches work on the whole array at once. When numpy is
+    installed the bulk operations run on a numpy view of the same array.
+    """
+    def __init__(self, rows, columns, emptyValue=0):
         self.columns = columns
         self.rows = rows
-        self.matrix = []
-        for row in range(rows):
-            currentRow = []
-            for column in range(columns):
-                currentRow.append(0)
-            self.matrix.append(currentRow)
-    
+        # ID 0 is always the empty value
+        self.items = [emptyValue]
+        self.ids = {self.itemKey(emptyValue): 0}
+        self.cells = array('i', [0]) * (rows * columns)
+        # how many cells and journal entries use each ID. IDs nothing uses
+        # are freed for reuse, so replaced objects aren't kept alive.
+        self.counts = [rows * columns]
+        self.free = []
+        self.unusedIds = []
+        # change tracking, off until a journal or observer is added
+        self.tracking = False
+        self.journal = None
+        self.observers = []
+        self.pending = []
+        self.depth = 0
+        self.batch = 0
+
+    def itemKey(self, item):
+        """
+        Returns the key used to look up an item's ID. The type is part of
+        the key, so equal values of different types, such as 1, 1.0 and
+        True, keep their own IDs. Unhashable items are looked up by
+        identity.
+        """
+        try:
+            hash(item)
+        except TypeError:
+            return ("id", id(item))
+        return (type(item), item)
+
+    def itemId(self, item):
+        """
+        Returns the ID for an item, adding it to the side table if needed.
+        An ID that no cell uses may be freed by the next bulk operation.
+        """
+        key = self.itemKey(item)
+        itemId = self.ids.get(key)
+        if itemId is None:
+            if self.free:
+                itemId = self.free.pop()
+                self.items[itemId] = item
+            else:
+                itemId = len(self.items)
+                self.items.append(item)
+                self.counts.append(0)
+            self.ids[key] = itemId
+        return itemId
+
+    def unused(self, itemId):
+        """
+        Frees an ID whose count has dropped to 0. Inside a transaction this
+        waits until the observers have been told about the changes.
+        """
+        if self.depth:
+            self.unusedIds.append(itemId)
+        else:
+            self.release(itemId)
+
+    def release(self, itemId):
+        if not itemId or self.counts[itemId]:
+            return None
+        key = self.itemKey(self.items[itemId])
+        if self.ids.get(key) != itemId:
+            # already freed
+            return None
+        del self.ids[key]
+        self.items[itemId] = None
+        self.free.append(itemId)
+
+    def dropReference(self, itemId):
+        self.counts[itemId] -= 1
+        if not self.counts[itemId]:
+            self.unused(itemId)
+
+    def recount(self):
+        """
+        Recounts the uses of every ID and frees the unused ones, after the
+        cells have been written in bulk
+        """
+        if numpy is not None:
+            counts = numpy.bincount(numpy.frombuffer(self.cells,
+                                                     dtype=numpy.int32),
+                                    minlength=len(self.items)).tolist()
+        else:
+            counts = [0] * len(self.items)
+            for itemId in self.cells:
+                counts[itemId] += 1
+        if self.journal is not None:
+            for itemId in self.journal.referencedIds():
+                counts[itemId] += 1
+        self.counts = counts
+        self.ids = {}
+        self.free = []
+        self.unusedIds = []
+        for itemId, item in enumerate(self.items):
+            if itemId and not counts[itemId]:
+                self.items[itemId] = None
+                self.free.append(itemId)
+            else:
+                self.ids.setdefault(self.itemKey(item), itemId)
+
+    def findId(self, item):
+        """
+        Returns the ID for an item, or None if it is not in the side table
+        """
+        return self.ids.get(self.itemKey(item))
+
     def setItem(self, item, row, column):
-        self.matrix[row][column] = item
-    
+        index = row * self.columns + column
+        itemId = self.itemId(item)
+        oldId = self.cells[index]
+        if oldId == itemId:
+            return None
+        self.cells[index] = itemId
+        counts = self.counts
+        counts[itemId] += 1
+        counts[oldId] -= 1
+        if self.tracking:
+            self.changed(index, oldId, itemId)
+        if not counts[oldId]:
+            self.unused(oldId)
+
     def getItem(self, row, column):
-        return self.matrix[row][column]
-    
+        return self.items[self.cells[row * self.columns + column]]
+
+    def getId(self, row, column):
+        return self.cells[row * self.columns + column]
+
+    def cell(self, index):
+        """
+        Returns the (row, column) of an index into self.cells
+        """
+        return divmod(index, self.columns)
+
+    ##### BULK OPERATIONS #####
+    def asArray(self):
+        """
+        Returns a (rows, columns) numpy int32 view of the cell IDs. Writing
+        to the view writes to the grid.
+        """
+        if numpy is None:
+            raise ImportError("Grid.asArray requires numpy")
+        view = numpy.frombuffer(self.cells, dtype=numpy.int32)
+        return view.reshape(self.rows, self.columns)
+
+    def fill(self, item):
+        """
+        Sets every cell to item
+        """
+        itemId = self.itemId(item)
+        if self.tracking:
+            before = self.cells[:]
+        if numpy is not None:
+            self.asArray()[:] = itemId
+        else:
+            self.cells[:] = array('i', [itemId]) * len(self.cells)
+        if self.tracking:
+            self.changedSince(before)
+        else:
+            self.recount()
+
+    def clear(self, emptyValue=0):
+        """
+        Sets every cell to emptyValue
+        """
+        self.fill(emptyValue)
+
+    def replace(self, old, new):
+        """
+        Replaces every cell containing old with new. Returns the number of
+        cells changed.
+        """
+        oldId = self.findId(old)
+        if oldId is None:
+            return 0
+        newId = self.itemId(new)
+        if oldId == newId:
+            return 0
+        if self.tracking:
+            before = self.cells[:]
+        if numpy is not None:
+            view = self.asArray()
+            found = view == oldId
+            view[found] = newId
+            changed = int(found.sum())
+        else:
+            indices = self.findIndices(oldId)
+            cells = self.cells
+            for index in indices:
+                cells[index] = newId
+            changed = len(indices)
+        if self.tracking:
+            self.changedSince(before)
+        else:
+            self.recount()
+        return changed
+
+    def fillEmpty(self, item, emptyValue=0):
+        """
+        Fills every cell containing emptyValue with item. Returns the
+        number of cells filled.
+        """
+        return self.replace(emptyValue, item)
+
+    def findIndices(self, itemId):
+        """
+        Returns the indices of all cells containing an ID. Without numpy the
+        search runs over the raw bytes of the array rather than cell by cell.
+        """
+        if numpy is not None:
+            return numpy.flatnonzero(self.asArray() == itemId).tolist()
+        data = self.cells.tostring()
+        pattern = array('i', [itemId]).tostring()
+        size = self.cells.itemsize
+        indices = []
+        position = data.find(pattern)
+        while position != -1:
+            if position % size:
+                # match straddles two cells
+                position = data.find(pattern, position + 1)
+                continue
+            indices.append(position // size)
+            position = data.find(pattern, position + size)
+        return indices
+
+    def occupied(self, emptyValue=0):
+        """
+        Returns a list of (row, column, item) for every cell not containing
+        emptyValue
+        """
+        emptyId = self.findId(emptyValue)
+        items = self.items
+        columns = self.columns
+        if numpy is not None:
+            cells = numpy.frombuffer(self.cells, dtype=numpy.int32)
+            if emptyId is None:
+                indices = numpy.arange(len(cells))
+            else:
+                indices = numpy.flatnonzero(cells != emptyId)
+            return [(index // columns, index % columns, items[itemId])
+                    for index, itemId in zip(indices.tolist(),
+                                             cells[indices].tolist())]
+        return [(index // columns, index % columns, items[itemId])
+                for index, itemId in enumerate(self.cells)
+                if itemId != emptyId]
+
+    def find(self, item):
+        """
+        Returns a list of the (row, column) cells containing item
+        """
+        itemId = self.findId(item)
+        if itemId is None:
+            return []
+        return [divmod(index, self.columns)
+                for index in self.findIndices(itemId)]
+
+    def findEmpty(self, emptyValue=0):
+        """
+        Returns a list of the (row, column) cells containing emptyValue
+        """
+        return self.find(emptyValue)
+
+    def count(self, item):
+        """
+        Returns the number of cells containing item
+        """
+        itemId = self.findId(item)
+        if itemId is None:
+            return 0
+        return self.cells.count(itemId)
+
+    def mask(self, item):
+        """
+        Returns a mask with 1 for every cell containing item and 0 elsewhere.
+        With numpy this is a (rows, columns) bool array, otherwise a
+        bytearray in the same order as self.cells.
+        """
+        itemId = self.findId(item)
+        if numpy is not None:
+            if itemId is None:
+                return numpy.zeros((self.rows, self.columns), dtype=bool)
+            return self.asArray() == itemId
+        mask = bytearray(len(self.cells))
+        if itemId is not None:
+            for index in self.findIndices(itemId):
+                mask[index] = 1
+        return mask
+
+    def setMask(self, item, mask):
+        """
+        Sets every cell whose entry in mask is 1 to item. Accepts either
+        kind of mask returned by Grid.mask.
+        """
+        itemId = self.itemId(item)
+        if self.tracking:
+            before = self.cells[:]
+        if numpy is not None:
+            mask = numpy.asarray(mask, dtype=bool).reshape(self.rows,
+                                                           self.columns)
+            self.asArray()[mask] = itemId
+        else:
+            cells = self.cells
+            position = mask.find(b"\x01")
+            while position != -1:
+                cells[position] = itemId
+                position = mask.find(b"\x01", position + 1)
+        if self.tracking:
+            self.changedSince(before)
+        else:
+            self.recount()
+
+    def compact(self):
+        """
+        Renumbers the IDs in use from 1 upwards, shrinking the side table.
+        Unused IDs are freed automatically, so this is only needed to
+        reclaim the space of a table that was once much larger.
+        """
+        # the journal's IDs would no longer mean the same items
+        if self.journal is not None:
+            self.journal.clear(False)
+        used = set(self.cells)
+        used.add(0)
+        remap = {}
+        items = []
+        for oldId in sorted(used):
+            remap[oldId] = len(items)
+            items.append(self.items[oldId])
+        self.cells[:] = array('i', [remap[itemId] for itemId in self.cells])
+        self.items = items
+        self.recount()
+
+    def setContents(self, cells, items):
+        """
+        Replaces the side table with items and, unless cells is None, the
+        cell IDs with cells, which must be the same length
+        """
+        self.items = list(items)
+        if cells is not None:
+            self.cells[:] = cells
+        self.cellsReplaced()
+
+    ##### CHANGE TRACKING #####
+    def startJournal(self, size=4096):
+        """
+        Starts recording changes in a Journal holding the last size
+        changes, for undo and for systems catching up on changes
+        """
+        if self.journal is not None:
+            self.journal.clear()
+        self.journal = Journal(size, self)
+        self.updateTracking()
+        return self.journal
+
+    def stopJournal(self):
+        if self.journal is not None:
+            self.journal.clear()
+        self.journal = None
+        self.updateTracking()
+
+    def subscribe(self, observer):
+        """
+        Calls observer(grid, changes) after each change, or once at the end
+        of each transaction, with a list of (row, column, old, new) items.
+        changes is None when the whole grid was replaced.
+        """
+        self.observers.append(observer)
+        self.updateTracking()
+
+    def unsubscribe(self, observer):
+        self.observers.remove(observer)
+        self.updateTracking()
+
+    def updateTracking(self):
+        self.tracking = self.journal is not None or bool(self.observers)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Groups the changes made inside a with block into one change event
+        and one undo step. Transactions can be nested.
+        """
+        self.depth += 1
+        try:
+            yield self
+        finally:
+            self.depth -= 1
+            if not self.depth:
+                self.commit()
+
+    def changed(self, index, oldId, newId):
+        """
+        Records that a cell's ID has changed
+        """
+        if oldId == newId:
+            return None
+        if self.journal is not None:
+            self.journal.record(index, oldId, newId, self.batch)
+        self.pending.append((index, oldId, newId))
+        if not self.depth:
+            self.commit()
+
+    def changedSince(self, before):
+        """
+        Records every cell that differs from a copy of the cells, as one
+        change event
+        """
+        counts = self.counts
+        with self.transaction():
+            if numpy is not None:
+                old = numpy.frombuffer(before, dtype=numpy.int32)
+                new = numpy.frombuffer(self.cells, dtype=numpy.int32)
+                indices = numpy.flatnonzero(old != new)
+                changes = zip(indices.tolist(), old[indices].tolist(),
+                              new[indices].tolist())
+            else:
+                changes = [(index, oldId, newId) for index, (oldId, newId)
+                           in enumerate(zip(before, self.cells))
+                           if oldId != newId]
+            for index, oldId, newId in changes:
+                counts[newId] += 1
+                counts[oldId] -= 1
+                self.changed(index, oldId, newId)
+            for oldId in set(oldId for index, oldId, newId in changes):
+                if not counts[oldId]:
+                    self.unused(oldId)
+
+    def commit(self):
+        """
+        Ends the current undo step and tells the observers about its changes
+        """
+        self.batch += 1
+        pending = self.pending
+        self.pending = []
+        if pending and self.observers:
+            self.notify(pending)
+        # IDs emptied during the transaction can go now the observers
+        # have seen their items
+        unusedIds = self.unusedIds
+        self.unusedIds = []
+        for itemId in unusedIds:
+            self.release(itemId)
+
+    def notify(self, pending):
+        items = self.items
+        columns = self.columns
+        changes = [(index // columns, index % columns, items[oldId],
+                    items[newId]) for index, oldId, newId in pending]
+        for observer in list(self.observers):
+            observer(self, changes)
+
+    def cellsReplaced(self):
+        """
+        Tells the observers that every cell may have changed, for code that
+        writes to self.cells directly, and recounts the IDs in use. The
+        journal is cleared, since it can't be undone past this point.
+        """
+        if self.journal is not None:
+            self.journal.clear(False)
+        self.pending = []
+        self.recount()
+        for observer in list(self.observers):
+            observer(self, None)
+
+    def undo(self):
+        """
+        Reverts the most recent change or transaction in the journal,
+        telling the observers. Returns the number of cells reverted, which
+        is 0 if that step had more changes than the journal holds.
+        """
+        if self.journal is None:
+            return 0
+        entries = self.journal.popBatch()
+        cells = self.cells
+        counts = self.counts
+        for index, oldId, newId in entries:
+            cells[index] = oldId
+            counts[oldId] += 1
+            counts[newId] -= 1
+        if entries and self.observers:
+            self.notify([(index, newId, oldId)
+                         for index, oldId, newId in entries])
+        # the popped entries no longer hold on to their IDs
+        for index, oldId, newId in entries:
+            self.dropReference(oldId)
+            self.dropReference(newId)
+        return len(entries)
+
+    @property
+    def matrix(self):
+        """
+        The grid contents as a list of row lists
+        """
+        items = self.items
+        columns = self.columns
+        return [[items[itemId] for itemId in self.cells[r * columns:
+                                                       (r + 1) * columns]]
+                for r in range(self.rows)]
+
     def __iter__(self):
         for row in range(self.rows):
             for column in range(self.columns):
-                yield (row, column)
\ No newline at end of file
+                yield (row, column)
+
+class Journal(object):
+    """
+    A ring buffer of (index, oldId, newId) cell changes, each tagged with
+    the undo step it belongs to. Once full, the oldest undo step is
+    dropped whole to make room, so no step is left half undoable. A step
+    with more changes than the journal holds can't be undone at all. While
+    a change is held its IDs count as used by grid, so the items can be
+    restored.
+    """
+    def __init__(self, size=4096, grid=None):
+        self.size = size
+        self.grid = grid
+        self.indices = array('i', [0]) * size
+        self.oldIds = array('i', [0]) * size
+        self.newIds = array('i', [0]) * size
+        self.batches = array('i', [0]) * size
+        self.position = 0
+        self.count = 0
+        # changes ever recorded, so readers can ask for what they missed
+        self.total = 0
+        # the undo step that lost its oldest changes, if any
+        self.incomplete = None
+
+    def dropOldest(self, batch):
+        """
+        Drops the oldest undo step to make room for a change to batch
+        """
+        oldest = self.batches[(self.position - self.count) % self.size]
+        while self.count:
+            position = (self.position - self.count) % self.size
+            if self.batches[position] != oldest:
+                break
+            if self.grid is not None:
+                self.grid.dropReference(self.oldIds[position])
+                self.grid.dropReference(self.newIds[position])
+            self.count -= 1
+        if oldest == batch:
+            self.incomplete = batch
+        elif oldest == self.incomplete:
+            self.incomplete = None
+
+    def record(self, index, oldId, newId, batch):
+        if self.count == self.size:
+            self.dropOldest(batch)
+        position = self.position
+        if self.grid is not None:
+            self.grid.counts[oldId] += 1
+            self.grid.counts[newId] += 1
+        self.indices[position] = index
+        self.oldIds[position] = oldId
+        self.newIds[position] = newId
+        self.batches[position] = batch
+        self.position = (position + 1) % self.size
+        self.count += 1
+        self.total += 1
+
+    def entries(self, since=None):
+        """
+        Returns the changes recorded since total was since, or all those
+        still held, oldest first
+        """
+        count = self.count
+        if since is not None:
+            count = min(count, self.total - since)
+        entries = []
+        for back in range(count, 0, -1):
+            position = (self.position - back) % self.size
+            entries.append((self.indices[position], self.oldIds[position],
+                            self.newIds[position]))
+        return entries
+
+    def popBatch(self):
+        """
+        Removes and returns the changes of the newest undo step, newest
+        first. Returns an empty list if that step is incomplete.
+        """
+        entries = []
+        if not self.count:
+            return entries
+        batch = self.batches[(self.position - 1) % self.size]
+        if batch == self.incomplete:
+            return entries
+        while self.count:
+            position = (self.position - 1) % self.size
+            if self.batches[position] != batch:
+                break
+            entries.append((self.indices[position], self.oldIds[position],
+                            self.newIds[position]))
+            self.position = position
+            self.count -= 1
+            self.total -= 1
+        return entries
+
+    def referencedIds(self):
+        """
+        Returns the old and new IDs of every change held
+        """
+        ids = []
+        for back in range(self.count, 0, -1):
+            position = (self.position - back) % self.size
+            ids.append(self.oldIds[position])
+            ids.append(self.newIds[position])
+        return ids
+
+    def clear(self, release=True):
+        """
+        Drops every change held. If release is False the grid's counts are
+        left for the caller to rebuild.
+        """
+        if release and self.grid is not None:
+            for itemId in self.referencedIds():
+                self.grid.dropReference(itemId)
+        self.position = 0
+        self.count = 0
+        self.incomplete = None
+
+    def __len__(self):
+        return self.count
@@ -1,9 +1,324 @@
 import pygame
+import struct, time
+
+##### EVENT SOURCES #####
+class LiveSource(object):
+    """
+    Reads events from pygame's event queue
+    """
+    def poll(self):
+        return pygame.event.poll()
+
+    def events(self):
+        return pygame.event.get()
+
+    def wait(self, timeout=None):
+        if timeout:
+            return pygame.event.wait(timeout)
+        return pygame.event.wait()
+
+    def ticks(self):
+        return pygame.time.get_ticks()
+
+    def close(self):
+        return None
+
+# input log: header, then for every poll, events or wait call a frame of
+# (ticks since recording started, event count) followed by its events
+MAGIC = b"GRIN"
+VERSION = 1
+HEADER = struct.Struct("<4sI")
+FRAME = struct.Struct("<IH")
+EVENT_TYPE = struct.Struct("<H")
+KEY = struct.Struct("<iHI")
+BUTTON = struct.Struct("<hhB")
+MOTION = struct.Struct("<hhhhB")
+# the recorded event types
+EVENTS = {pygame.KEYDOWN: KEY,
+          pygame.KEYUP: KEY,
+          pygame.MOUSEBUTTONDOWN: BUTTON,
+          pygame.MOUSEBUTTONUP: BUTTON,
+          pygame.MOUSEMOTION: MOTION,
+          pygame.QUIT: None}
+
+def packEvent(event):
+    layout = EVENTS[event.type]
+    data = EVENT_TYPE.pack(event.type)
+    if layout is KEY:
+        character = getattr(event, "unicode", u"") or u"\0"
+        data += KEY.pack(event.key, getattr(event, "mod", 0),
+                         ord(character[0]))
+    elif layout is BUTTON:
+        data += BUTTON.pack(event.pos[0], event.pos[1], event.button)
+    elif layout is MOTION:
+        buttons = 0
+        for n, pressed in enumerate(event.buttons):
+            if pressed:
+                buttons |= 1 << n
+        data += MOTION.pack(event.pos[0], event.pos[1], event.rel[0],
+                            event.rel[1], buttons)
+    return data
+
+def unpackEvent(data, offset):
+    """
+    Returns a synthetic pygame event read from data at offset, and the
+    offset after it
+    """
+    eventType = EVENT_TYPE.unpack_from(data, offset)[0]
+    offset += EVENT_TYPE.size
+    layout = EVENTS[eventType]
+    if layout is KEY:
+        key, mod, character = KEY.unpack_from(data, offset)
+        attributes = {"key": key, "mod": mod,
+                      "unicode": unichr(character) if character else u""}
+    elif layout is BUTTON:
+        x, y, button = BUTTON.unpack_from(data, offset)
+        attributes = {"pos": (x, y), "button": button}
+    elif layout is MOTION:
+        x, y, dx, dy, buttons = MOTION.unpack_from(data, offset)
+        attributes = {"pos": (x, y), "rel": (dx, dy),
+                      "buttons": tuple(int(bool(buttons & 1 << n))
+                                       for n in range(3))}
+    else:
+        attributes = {}
+    if layout is not None:
+        offset += layout.size
+    return pygame.event.Event(eventType, attributes), offset
+
+class RecordingSource(object):
+    """
+    Passes on the events of another source while logging the key, mouse
+    and quit events to a file, frame by frame
+    """
+    def __init__(self, source, filename):
+        self.source = source
+        self.file = open(filename, "wb")
+        self.file.write(HEADER.pack(MAGIC, VERSION))
+        self.start = source.ticks()
+        self.lastTicks = None
+
+    def record(self, events):
+        # the frame is stamped with the time the game loop last read, so
+        # a replay gives the loop the same times
+        ticks = self.lastTicks
+        if ticks is None:
+            ticks = self.source.ticks()
+        self.lastTicks = None
+        events = [event for event in events if event.type in EVENTS]
+        self.file.write(FRAME.pack(max(ticks - self.start, 0), len(events)) +
+                        b"".join(packEvent(event) for event in events))
+
+    def poll(self):
+        event = self.source.poll()
+        self.record([event])
+        return event
+
+    def events(self):
+        events = self.source.events()
+        self.record(events)
+        return events
+
+    def wait(self, timeout=None):
+        event = self.source.wait(timeout)
+        self.lastTicks = None
+        self.record([event])
+        return event
+
+    def ticks(self):
+        self.lastTicks = self.source.ticks()
+        return self.lastTicks
+
+    def close(self):
+        self.file.close()
+
+class ReplaySource(object):
+    """
+    Plays back a recorded input log without a display. By default each call
+    to poll, events or wait returns the next recorded frame straight
+    away, and ticks returns the recorded time, so a game loop driven by
+    the engine's run sees the same events and the same simulation steps
+    as when it was recorded, as fast as it can go. With realtime, frames
+    are released at the speed they were recorded. Once the log runs out a
+    QUIT event is returned.
+    """
+    def __init__(self, filename, realtime=False):
+        with open(filename, "rb") as source:
+            data = source.read()
+        magic, version = HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a Greasy input log" % filename)
+        self.frames = []
+        offset = HEADER.size
+        while offset < len(data):
+            ticks, count = FRAME.unpack_from(data, offset)
+            offset += FRAME.size
+            events = []
+            for n in range(count):
+                event, offset = unpackEvent(data, offset)
+                events.append(event)
+            self.frames.append((ticks, events))
+        self.realtime = realtime
+        self.position = 0
+        self.buffer = []
+        self.start = None
+
+    def elapsed(self):
+        if self.start is None:
+            self.start = time.time()
+        return int((time.time() - self.start) * 1000)
+
+    def finished(self):
+        return self.position >= len(self.frames) and not self.buffer
+
+    def nextFrame(self):
+        """
+        Returns the events of the next frame, or of every frame due in
+        realtime mode
+        """
+        if self.position >= len(self.frames):
+            return [pygame.event.Event(pygame.QUIT, {})]
+        if not self.realtime:
+            self.position += 1
+            return list(self.frames[self.position - 1][1])
+        now = self.elapsed()
+        events = []
+        while (self.position < len(self.frames) and
+               self.frames[self.position][0] <= now):
+            events.extend(self.frames[self.position][1])
+            self.position += 1
+        return events
+
+    def poll(self):
+        if not self.buffer:
+            self.buffer = self.nextFrame()
+        if not self.buffer:
+            return pygame.event.Event(pygame.NOEVENT, {})
+        return self.buffer.pop(0)
+
+    def events(self):
+        events = self.buffer + self.nextFrame()
+        self.buffer = []
+        return events
+
+    def wait(self, timeout=None):
+        while not self.buffer:
+            if self.realtime and self.position < len(self.frames):
+                delay = self.frames[self.position][0] - self.elapsed()
+                if delay > 0:
+                    time.sleep(delay / 1000.0)
+            self.buffer = self.nextFrame()
+        return self.buffer.pop(0)
+
+    def ticks(self):
+        if self.realtime:
+            return self.elapsed()
+        if self.position < len(self.frames):
+            return self.frames[self.position][0]
+        if self.frames:
+            return self.frames[-1][0]
+        return 0
+
+    def close(self):
+        return None
+
 class InputHandler():
+    def __init__(self, source=None):
+        self.handlers = {}
+        # where events come from: pygame's queue, a recording or a replay
+        self.source = source or LiveSource()
+
     def input(self):
-        currentEvent = pygame.event.poll()
+        currentEvent = self.source.poll()
         return currentEvent
     
+    def events(self):
+        """
+        Return every event in the queue, emptying it
+        """
+        return self.source.events()
+    
+    def wait(self, timeout=None):
+        """
+        Sleep until an event arrives and return it. If timeout (in
+        milliseconds) runs out first, a NOEVENT event is returned.
+        """
+        return self.source.wait(timeout)
+
+    def ticks(self):
+        """
+        Return the time in milliseconds according to the event source
+        """
+        return self.source.ticks()
+
+    def record(self, filename):
+        """
+        Start logging the events read from the current source to a file
+        """
+        self.stopRecording()
+        self.source = RecordingSource(self.source, filename)
+
+    def stopRecording(self):
+        if isinstance(self.source, RecordingSource):
+            self.source.close()
+            self.source = self.source.source
+
+    def replay(self, filename, realtime=False):
+        """
+        Read events from a recorded log instead. See ReplaySource.
+        """
+        self.stopRecording()
+        self.source = ReplaySource(filename, realtime)
+        return self.source
+
+    def live(self):
+        """
+        Go back to reading events from pygame's queue
+        """
+        self.stopRecording()
+        self.source = LiveSource()
+    
+    def block(self, eventTypes):
+        """
+        Stop events of the given type, or list of types, reaching the queue
+        """
+        pygame.event.set_blocked(eventTypes)
+    
+    def allow(self, eventTypes):
+        """
+        Allow events of the given type, or list of types, onto the queue
+        """
+        pygame.event.set_allowed(eventTypes)
+    
+    def bind(self, eventType, handler, key=None):
+        """
+        Call handler(event) when dispatch meets an event of eventType. If
+        key is given, only KEYDOWN/KEYUP events for that key match.
+        """
+        self.handlers.setdefault((eventType, key), []).append(handler)
+    
+    def unbind(self, eventType, handler, key=None):
+        try:
+            self.handlers[(eventType, key)].remove(handler)
+        except (KeyError, ValueError):
+            return None
+    
+    def dispatch(self, events=None):
+        """
+        Pass each event to the handlers bound to its type and key. If events
+        is None the queue is drained first. Returns the events dispatched.
+        """
+        if events is None:
+            events = self.events()
+        handlers = self.handlers
+        for currentEvent in events:
+            key = getattr(currentEvent, "key", None)
+            if key is not None:
+                for handler in handlers.get((currentEvent.type, key), ()):
+                    handler(currentEvent)
+            for handler in handlers.get((currentEvent.type, None), ()):
+                handler(currentEvent)
+        return events
+    
     def checkInput(self, input):
         if input.type != pygame.NOEVENT:
             return True
@@ -12,7 +327,9 @@ class InputHandler():
     
     def checkMouseInput(self, input):
         if input.type == pygame.MOUSEBUTTONUP:
-            return pygame.mouse.get_pos()
+            # the position of the click itself, which replayed events carry;
+            # events built by hand without one fall back to the pointer
+            return getattr(input, "pos", None) or pygame.mouse.get_pos()
         else:
             return None
     
@@ -0,0 +1,72 @@
+import grid as g
+import pygame
+
+class Layer(object):
+    """
+    A named grid drawn over the engine's main grid. A static layer is
+    composed into one cached surface and only recomposed after one of its
+    cells changes. A dynamic layer is redrawn every frame with one
+    Surface.blits call.
+    """
+    def __init__(self, name, rows, columns, imageWidth, imageHeight,
+                 static=False):
+        self.name = name
+        self.grid = g.Grid(rows, columns)
+        self.imageWidth = imageWidth
+        self.imageHeight = imageHeight
+        self.static = static
+        self.visible = True
+        self.surface = None
+        self.dirty = True
+
+    def invalidate(self):
+        """
+        Marks a static layer as needing to be recomposed
+        """
+        self.dirty = True
+
+    def blitList(self, empty=0):
+        """
+        Returns a list of (surface, position) pairs for every occupied cell
+        """
+        width = self.imageWidth
+        height = self.imageHeight
+        return [(item, (r * width, c * height))
+                for r, c, item in self.grid.occupied(empty)]
+
+    def compose(self, empty=0):
+        """
+        Draws the layer onto its cached transparent surface
+        """
+        size = (self.grid.rows * self.imageWidth,
+                self.grid.columns * self.imageHeight)
+        if not self.surface or self.surface.get_size() != size:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA).convert_alpha()
+        self.surface.fill((0, 0, 0, 0))
+        self.surface.blits(self.blitList(empty), False)
+        self.dirty = False
+
+    def draw(self, dest, empty=0):
+        if not self.visible:
+            return None
+        if self.static:
+            if self.dirty:
+                self.compose(empty)
+            dest.blit(self.surface, (0, 0))
+        else:
+            dest.blits(self.blitList(empty), False)
+
+    def drawCell(self, dest, row, column, rect, empty=0):
+        """
+        Draws just one cell of the layer into rect
+        """
+        if not self.visible:
+            return None
+        if self.static:
+            if self.dirty:
+                self.compose(empty)
+            dest.blit(self.surface, rect, rect)
+        else:
+            currentItem = self.grid.getItem(row, column)
+            if currentItem != empty:
+                dest.blit(currentItem, rect)
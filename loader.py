@@ -0,0 +1,223 @@
+"""
+Loading images and sounds in the background.
+
+Files are read and decoded by a pool of worker threads; pygame's decoders
+release the GIL while they work. Converting an image for the display has
+to happen on the main thread, so decoded assets are queued and finished a
+few at a time by update, which the engine calls every frame.
+"""
+from timeit import default_timer
+import threading, Queue
+import pygame
+
+class LoadRequest(object):
+    """
+    A pending image or sound. Once done is True, result holds the loaded
+    asset, or None if loading failed, in which case error holds the
+    exception.
+    """
+    def __init__(self, kind, key, filename):
+        self.kind = kind
+        self.key = key
+        self.filename = filename
+        self.data = None
+        self.decodeTime = 0.0
+        self.result = None
+        self.error = None
+        self.done = False
+        self.callbacks = []
+
+    def addCallback(self, callback):
+        """
+        Calls callback(request) on the main thread once the asset is
+        loaded, or straight away if it already is
+        """
+        if self.done:
+            callback(self)
+        else:
+            self.callbacks.append(callback)
+
+    def finish(self, result, error=None):
+        self.result = result
+        self.error = error
+        self.done = True
+        callbacks = self.callbacks
+        self.callbacks = []
+        for callback in callbacks:
+            callback(self)
+
+class AssetLoader(object):
+    """
+    Loads images into a GreasyEngine's asset cache and sounds into its
+    sound bank without blocking the main thread
+    """
+    def __init__(self, engine, workers=4, batch=4):
+        """
+        Parameters
+        ----------
+        engine: GreasyEngine
+            engine whose caches are filled
+        workers: int, optional, default=4
+            number of decoding threads
+        batch: int, optional, default=4
+            most assets converted and added by each call to update
+        """
+        self.engine = engine
+        self.batch = batch
+        self.pending = {}
+        self.requests = Queue.Queue()
+        self.decoded = Queue.Queue()
+        self.total = 0
+        self.finished = 0
+        self.failed = 0
+        self.threads = []
+        for n in range(workers):
+            thread = threading.Thread(target=self.work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def work(self):
+        """
+        Worker thread decoding requested files
+        """
+        while True:
+            request = self.requests.get()
+            if request is None:
+                return None
+            start = default_timer()
+            try:
+                if request.kind == "image":
+                    request.data = pygame.image.load(request.filename)
+                else:
+                    request.data = pygame.mixer.Sound(request.filename)
+            except (pygame.error, IOError) as error:
+                request.error = error
+            request.decodeTime = default_timer() - start
+            self.decoded.put(request)
+
+    def queue(self, kind, key, filename, callback):
+        request = self.pending.get(key)
+        if request is None:
+            request = LoadRequest(kind, key, filename)
+            self.pending[key] = request
+            self.total += 1
+            self.requests.put(request)
+        if callback:
+            request.addCallback(callback)
+        return request
+
+    def loaded(self, kind, key, filename, result, callback):
+        request = LoadRequest(kind, key, filename)
+        request.finish(result)
+        if callback:
+            callback(request)
+        return request
+
+    def loadImage(self, filename, alpha=False, colourkey=None, resize=True,
+                  callback=None):
+        """
+        Starts loading an image with newObject's options and returns its
+        LoadRequest. callback(request) is called on the main thread once
+        the image is in the asset cache.
+        """
+        key = self.engine.assetKey(filename, alpha, colourkey, resize)
+        image = self.engine.assets.get(key)
+        if image is not None:
+            return self.loaded("image", key, filename, image, callback)
+        return self.queue("image", key, filename, callback)
+
+    def loadSound(self, filename, callback=None):
+        """
+        Starts loading a sound into the sound bank and returns its
+        LoadRequest
+        """
+        sound = self.engine.sound.sounds.get(filename)
+        if sound is not None:
+            return self.loaded("sound", filename, filename, sound, callback)
+        return self.queue("sound", filename, filename, callback)
+
+    def loadBackgroundMusic(self, filename, callback=None):
+        """
+        Like loadSound, and then makes the sound the background music
+        """
+        def setMusic(request):
+            if request.result is not None:
+                self.engine.sound.backgroundMusic = request.result
+        request = self.loadSound(filename, setMusic)
+        if callback:
+            request.addCallback(callback)
+        return request
+
+    def loadImages(self, filenames, alpha=False, colourkey=None, resize=True,
+                   callback=None):
+        """
+        Starts loading a list of images and returns their LoadRequests
+        """
+        return [self.loadImage(filename, alpha, colourkey, resize, callback)
+                for filename in filenames]
+
+    def update(self, batch=None):
+        """
+        Converts and adds up to batch decoded assets, calling their
+        callbacks. Must be called on the main thread. Returns the number of
+        assets finished.
+        """
+        if batch is None:
+            batch = self.batch
+        stats = self.engine.stats
+        finished = 0
+        while finished < batch:
+            try:
+                request = self.decoded.get_nowait()
+            except Queue.Empty:
+                break
+            del self.pending[request.key]
+            finished += 1
+            self.finished += 1
+            if request.error is not None:
+                self.failed += 1
+                print "Could not load", request.filename, "-", request.error
+                request.finish(None, request.error)
+                continue
+            if request.kind == "image":
+                start = default_timer()
+                result = self.engine.prepareImage(request.data, request.key)
+                if stats:
+                    stats.count("assetLoads", 1,
+                                (default_timer() - start) * 1000)
+            else:
+                result = request.data
+                self.engine.sound.addSound(request.filename, result,
+                                           request.decodeTime)
+            request.data = None
+            request.finish(result)
+        return finished
+
+    def progress(self):
+        """
+        Returns the fraction of requested assets that have finished
+        loading, or 1.0 if there are none
+        """
+        if not self.total:
+            return 1.0
+        return float(self.finished) / self.total
+
+    def busy(self):
+        return bool(self.pending)
+
+    def resetProgress(self):
+        """
+        Starts counting progress afresh, for example for the next loading
+        screen. Assets still loading are counted again.
+        """
+        self.total = len(self.pending)
+        self.finished = 0
+        self.failed = 0
+
+    def close(self):
+        """
+        Stops the worker threads once they finish their current file
+        """
+        for thread in self.threads:
+            self.requests.put(None)
@@ -0,0 +1,209 @@
+"""
+Whole-grid neighbourhood operations on masks.
+
+Every function takes and returns (rows, columns) numpy arrays, such as the
+masks from Grid.mask, so results can be written back with Grid.setMask.
+Masks indexed [row, column] line up with Grid.asArray. Needs numpy.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+ORTHOGONAL = ((-1, 0), (1, 0), (0, -1), (0, 1))
+DIAGONAL = ORTHOGONAL + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+def requireNumpy():
+    if numpy is None:
+        raise ImportError("neighbourhood operations require numpy")
+
+def convolve(values, kernel, wrap=False):
+    """
+    Returns the weighted sum of each cell's neighbourhood, where kernel is
+    an odd-sized 2D array of weights centred on the cell. The kernel is
+    not flipped. Cells beyond the edges count as 0, or wrap around.
+    """
+    requireNumpy()
+    values = numpy.asarray(values)
+    kernel = numpy.asarray(kernel)
+    kernelRows, kernelColumns = kernel.shape
+    padRows = kernelRows // 2
+    padColumns = kernelColumns // 2
+    padded = numpy.pad(values, ((padRows, padRows), (padColumns, padColumns)),
+                       "wrap" if wrap else "constant")
+    rows, columns = values.shape
+    total = numpy.zeros(values.shape, dtype=numpy.result_type(values, kernel,
+                                                              numpy.int32))
+    for i in range(kernelRows):
+        for j in range(kernelColumns):
+            weight = kernel[i, j]
+            if weight:
+                total += weight * padded[i:i + rows, j:j + columns]
+    return total
+
+def neighbourCounts(mask, diagonal=True, wrap=False):
+    """
+    Returns the number of each cell's neighbours that are set in mask,
+    counting diagonal neighbours unless diagonal is False
+    """
+    requireNumpy()
+    kernel = numpy.ones((3, 3), dtype=numpy.int32)
+    kernel[1, 1] = 0
+    if not diagonal:
+        kernel[0, 0] = kernel[0, 2] = kernel[2, 0] = kernel[2, 2] = 0
+    return convolve(numpy.asarray(mask, dtype=numpy.int32), kernel, wrap)
+
+def distanceMap(passable, sources, diagonal=False, maxDistance=None):
+    """
+    Returns every cell's distance in steps from the nearest source cell,
+    moving only through passable cells, or -1 for cells that can't be
+    reached. sources is a mask or a list of (row, column) cells. The
+    search moves a whole frontier of cells at a time.
+    """
+    requireNumpy()
+    passable = numpy.asarray(passable, dtype=bool)
+    rows, columns = passable.shape
+    # a border of impassable cells saves checking for the edges
+    width = columns + 2
+    unvisited = numpy.zeros((rows + 2, width), dtype=bool)
+    unvisited[1:-1, 1:-1] = passable
+    unvisited = unvisited.ravel()
+    distances = numpy.empty((rows + 2) * width, dtype=numpy.int32)
+    distances.fill(-1)
+    if isinstance(sources, numpy.ndarray):
+        sourceRows, sourceColumns = numpy.nonzero(sources)
+    else:
+        cells = numpy.array(list(sources), dtype=numpy.intp).reshape(-1, 2)
+        sourceRows, sourceColumns = cells[:, 0], cells[:, 1]
+    frontier = (sourceRows + 1) * width + sourceColumns + 1
+    distances[frontier] = 0
+    unvisited[frontier] = False
+    offsets = [dr * width + dc
+               for dr, dc in (DIAGONAL if diagonal else ORTHOGONAL)]
+    distance = 0
+    while len(frontier) and (maxDistance is None or distance < maxDistance):
+        distance += 1
+        found = []
+        for offset in offsets:
+            neighbours = frontier + offset
+            neighbours = neighbours[unvisited[neighbours]]
+            # marking cells as they are found stops later offsets adding
+            # them again
+            unvisited[neighbours] = False
+            distances[neighbours] = distance
+            found.append(neighbours)
+        frontier = numpy.concatenate(found)
+    return distances.reshape(rows + 2, width)[1:-1, 1:-1].copy()
+
+def floodFill(passable, seed, diagonal=False):
+    """
+    Returns a mask of the passable cells connected to the seed cell
+    """
+    return distanceMap(passable, [seed], diagonal) >= 0
+
+def label(mask, diagonal=False):
+    """
+    Labels the connected regions of a mask. Returns (labels, count), where
+    labels holds 1 to count for the cells of each region and 0 elsewhere.
+    Each row's runs of set cells are found first, and then the runs
+    touching each other are merged all at once, union-find style.
+    """
+    requireNumpy()
+    mask = numpy.asarray(mask, dtype=bool)
+    rows, columns = mask.shape
+    starts = mask.copy()
+    starts[:, 1:] &= ~mask[:, :-1]
+    # runs are numbered from 1, with 0 for unset cells
+    runs = numpy.cumsum(starts.ravel()).reshape(rows, columns) * mask
+    runCount = int(runs.max()) if runs.size else 0
+    pairs = [(runs[:-1], runs[1:])]
+    if diagonal:
+        pairs += [(runs[:-1, :-1], runs[1:, 1:]),
+                  (runs[:-1, 1:], runs[1:, :-1])]
+    keys = numpy.concatenate([(upper * (runCount + 1) + lower)[
+        (upper > 0) & (lower > 0)].ravel() for upper, lower in pairs])
+    first, second = numpy.divmod(numpy.unique(keys), runCount + 1)
+    parent = numpy.arange(runCount + 1)
+    while True:
+        firstRoot = parent[first]
+        secondRoot = parent[second]
+        joined = firstRoot != secondRoot
+        if not joined.any():
+            break
+        # hook the larger root of each pair onto the smaller
+        low = numpy.minimum(firstRoot[joined], secondRoot[joined])
+        high = numpy.maximum(firstRoot[joined], secondRoot[joined])
+        numpy.minimum.at(parent, high, low)
+        # then point every run straight at its root
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    unique, regions = numpy.unique(parent[1:], return_inverse=True)
+    labels = numpy.zeros(runCount + 1, dtype=numpy.int32)
+    labels[1:] = regions + 1
+    return labels[runs], len(unique)
+
+def distanceTransform(mask):
+    """
+    Returns every cell's Manhattan distance to the nearest cell set in
+    mask, ignoring obstacles, or -1 everywhere if mask is empty. Runs one
+    pass forwards and backwards along each axis, each moving a whole row
+    or column at a time.
+    """
+    requireNumpy()
+    mask = numpy.asarray(mask, dtype=bool)
+    rows, columns = mask.shape
+    far = rows + columns
+    distances = numpy.where(mask, 0, far).astype(numpy.int32)
+    for c in range(1, columns):
+        numpy.minimum(distances[:, c], distances[:, c - 1] + 1,
+                      distances[:, c])
+    for c in range(columns - 2, -1, -1):
+        numpy.minimum(distances[:, c], distances[:, c + 1] + 1,
+                      distances[:, c])
+    for r in range(1, rows):
+        numpy.minimum(distances[r], distances[r - 1] + 1, distances[r])
+    for r in range(rows - 2, -1, -1):
+        numpy.minimum(distances[r], distances[r + 1] + 1, distances[r])
+    distances[distances >= far] = -1
+    return distances
+
+def fieldOfView(opaque, origin, radius):
+    """
+    Returns a mask of the cells within radius of origin that can be seen
+    from it: those whose straight line from origin crosses no opaque cell
+    before reaching them. Opaque cells themselves can be seen. Every line
+    is traced at once, one step per pass.
+    """
+    requireNumpy()
+    opaque = numpy.asarray(opaque, dtype=bool)
+    rows, columns = opaque.shape
+    originRow, originColumn = origin
+    top = max(originRow - radius, 0)
+    left = max(originColumn - radius, 0)
+    targetRows, targetColumns = numpy.mgrid[top:min(originRow + radius + 1,
+                                                    rows),
+                                            left:min(originColumn + radius + 1,
+                                                     columns)]
+    rowSteps = targetRows - originRow
+    columnSteps = targetColumns - originColumn
+    inRange = rowSteps ** 2 + columnSteps ** 2 <= radius ** 2
+    rowSteps = rowSteps[inRange]
+    columnSteps = columnSteps[inRange]
+    lengths = numpy.maximum(abs(rowSteps), abs(columnSteps))
+    visible = numpy.ones(len(lengths), dtype=bool)
+    for step in range(1, radius):
+        # the cells each line passes through, short of its target
+        tracing = step < lengths
+        if not tracing.any():
+            break
+        fraction = step / lengths[tracing].astype(numpy.float64)
+        r = numpy.rint(originRow + rowSteps[tracing] * fraction).astype(int)
+        c = numpy.rint(originColumn +
+                       columnSteps[tracing] * fraction).astype(int)
+        visible[numpy.flatnonzero(tracing)[opaque[r, c]]] = False
+    view = numpy.zeros((rows, columns), dtype=bool)
+    view[originRow + rowSteps[visible], originColumn + columnSteps[visible]] = True
+    return view
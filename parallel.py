@@ -0,0 +1,148 @@
+"""
+Applying cellular automaton style rules to large grids across a process
+pool.
+
+The grid's cell IDs are copied into one of two shared memory buffers.
+The grid is split into tiles, and each worker process reads its tile plus
+a halo of neighbouring cells from the front buffer and writes the tile's
+new IDs to the back buffer, so tiles never need to wait for each other.
+The buffers are swapped after every step, and the result is copied back
+into the grid's cells in one memmove. Needs numpy.
+"""
+import ctypes, multiprocessing
+from multiprocessing.sharedctypes import RawArray
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# state inherited by each worker process
+shared = {}
+
+def initWorker(buffers, rows, columns):
+    shared["views"] = [numpy.frombuffer(buffer, dtype=numpy.int32)
+                       .reshape(rows, columns) for buffer in buffers]
+
+def readBlock(source, firstRow, lastRow, firstColumn, lastColumn, halo,
+              wrap):
+    """
+    Returns the cells of a tile plus halo cells on every side. Outside the
+    grid the halo is empty, or wraps around to the other side.
+    """
+    rows, columns = source.shape
+    if wrap:
+        rowIndices = numpy.arange(firstRow - halo, lastRow + halo) % rows
+        columnIndices = numpy.arange(firstColumn - halo,
+                                     lastColumn + halo) % columns
+        return source.take(rowIndices, axis=0).take(columnIndices, axis=1)
+    top = max(firstRow - halo, 0)
+    left = max(firstColumn - halo, 0)
+    bottom = min(lastRow + halo, rows)
+    right = min(lastColumn + halo, columns)
+    return numpy.pad(source[top:bottom, left:right],
+                     ((top - (firstRow - halo), lastRow + halo - bottom),
+                      (left - (firstColumn - halo), lastColumn + halo - right)),
+                     "constant")
+
+def updateTile(task):
+    rule, front, tile, halo, wrap, args = task
+    firstRow, lastRow, firstColumn, lastColumn = tile
+    views = shared["views"]
+    block = readBlock(views[front], firstRow, lastRow, firstColumn,
+                      lastColumn, halo, wrap)
+    views[1 - front][firstRow:lastRow, firstColumn:lastColumn] = \
+        rule(block, halo, *args)
+
+def life(block, halo, alive, dead=0):
+    """
+    An example rule: Conway's Game of Life between two item IDs
+    """
+    core = block[halo:-halo, halo:-halo]
+    neighbours = numpy.zeros(core.shape, dtype=numpy.int32)
+    height, width = core.shape
+    for dr in (-1, 0, 1):
+        for dc in (-1, 0, 1):
+            if dr or dc:
+                neighbours += block[halo + dr:halo + dr + height,
+                                    halo + dc:halo + dc + width] == alive
+    living = (neighbours == 3) | ((core == alive) & (neighbours == 2))
+    return numpy.where(living, alive, dead)
+
+class ParallelGrid(object):
+    """
+    Runs rules over a Greasy Grid on a pool of worker processes.
+
+    A rule is a module-level function called as
+    rule(block, halo, *args), where block is a numpy int32 array of a
+    tile's cell IDs with halo extra cells on every side, indexed
+    [row, column]. It returns the tile's new IDs, without the halo. Rules
+    work on item IDs, so get the IDs of any new items from grid.itemId
+    before stepping.
+    """
+    def __init__(self, grid, processes=None, tileSize=256, halo=1,
+                 wrap=False):
+        """
+        Parameters
+        ----------
+        grid: Greasy Grid
+            grid to update
+        processes: int, optional, default=None
+            number of worker processes, or one per CPU
+        tileSize: int, optional, default=256
+            rows and columns of cells in each tile
+        halo: int, optional, default=1
+            how far a rule can look beyond its tile
+        wrap: bool, optional, default=False
+            wrap the halo around the edges of the grid instead of treating
+            cells beyond them as empty
+        """
+        if numpy is None:
+            raise ImportError("ParallelGrid needs numpy")
+        self.grid = grid
+        self.halo = halo
+        self.wrap = wrap
+        size = grid.rows * grid.columns
+        self.buffers = [RawArray(ctypes.c_int32, size),
+                        RawArray(ctypes.c_int32, size)]
+        self.front = 0
+        self.tiles = [(r, min(r + tileSize, grid.rows),
+                       c, min(c + tileSize, grid.columns))
+                      for r in range(0, grid.rows, tileSize)
+                      for c in range(0, grid.columns, tileSize)]
+        self.pool = multiprocessing.Pool(processes, initWorker,
+                                         (self.buffers, grid.rows,
+                                          grid.columns))
+
+    def copyCells(self, toGrid):
+        """
+        Copies the grid's cells to the front buffer, or back again
+        """
+        cells = self.grid.cells
+        address, length = cells.buffer_info()
+        buffer = ctypes.addressof(self.buffers[self.front])
+        if toGrid:
+            ctypes.memmove(address, buffer, length * cells.itemsize)
+        else:
+            ctypes.memmove(buffer, address, length * cells.itemsize)
+
+    def step(self, rule, args=(), steps=1):
+        """
+        Applies a rule to every cell of the grid steps times, then writes
+        the result into the grid. Changes made to the grid since the last
+        step are picked up. Call the engine's markAll afterwards if the
+        grid is drawn.
+        """
+        self.copyCells(False)
+        for n in range(steps):
+            self.pool.map(updateTile,
+                          [(rule, self.front, tile, self.halo, self.wrap,
+                            args) for tile in self.tiles])
+            self.front = 1 - self.front
+        self.copyCells(True)
+        self.grid.cellsReplaced()
+        return self.grid
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -0,0 +1,492 @@
+from array import array
+from collections import deque
+from timeit import default_timer
+import heapq
+
+class Pathfinder(object):
+    """
+    Finds paths across a Greasy Grid, treating cells that contain
+    emptyValue as passable. Walkability is read from the grid once and then
+    kept up to date through cellChanged, so found paths and flow fields can
+    be cached until a change actually affects them. Cached flow fields are
+    repaired around changed cells rather than rebuilt, when they are next
+    asked for or by process.
+    """
+    def __init__(self, grid, emptyValue=0, searchStep=256):
+        self.grid = grid
+        self.emptyValue = emptyValue
+        self.searchStep = searchStep
+        self.walkable = None
+        self.paths = {}
+        self.cellPaths = {}
+        self.fields = {}
+        # goal -> (walkability the field was built or repaired for, cells
+        # blocked since, cells freed since)
+        self.fieldRepairs = {}
+        # goal -> (field, repair generator) for repairs spread across calls
+        self.repairing = {}
+        self.requests = deque()
+        self.search = None
+        # walkability changes so far, so a search spread across frames can
+        # tell if the grid changed under it
+        self.changes = 0
+        self.resets = 0
+        # the cells changed since each field build in progress started
+        self.fieldBuilds = []
+        self.pendingFields = set()
+        self.reset()
+
+    def reset(self):
+        """
+        Reads the walkability of every cell and drops all cached results
+        """
+        mask = self.grid.mask(self.emptyValue)
+        if not isinstance(mask, bytearray):
+            mask = bytearray(mask.astype("uint8").tobytes())
+        self.walkable = mask
+        self.changes += 1
+        self.resets += 1
+        self.paths = {}
+        self.cellPaths = {}
+        self.fields = {}
+        self.fieldRepairs = {}
+        self.repairing = {}
+
+    def cellChanged(self, row, column):
+        """
+        Updates the walkability of one cell. Cached paths through a cell
+        that has become blocked are dropped. A cell that has become free
+        only drops the paths it could shorten, and the paths that weren't
+        found. Flow fields are marked for repair.
+        """
+        columns = self.grid.columns
+        index = row * columns + column
+        walkable = int(self.grid.getItem(row, column) == self.emptyValue)
+        if self.walkable[index] == walkable:
+            return None
+        self.walkable[index] = walkable
+        self.changes += 1
+        for changed in self.fieldBuilds:
+            changed.add(index)
+        for goal in self.fields:
+            known, blocked, freed = self.fieldRepairs[goal]
+            if walkable:
+                blocked.discard(index)
+                freed.add(index)
+            else:
+                freed.discard(index)
+                blocked.add(index)
+        if not walkable:
+            for key in list(self.cellPaths.get(index, ())):
+                self.dropPath(key)
+            return None
+        for key, path in self.paths.items():
+            if path is None:
+                self.dropPath(key)
+                continue
+            # the shortest a path through the cell could be
+            (startRow, startColumn), (goalRow, goalColumn) = key
+            if (abs(startRow - row) + abs(startColumn - column) +
+                abs(goalRow - row) + abs(goalColumn - column) < len(path)):
+                self.dropPath(key)
+
+    def dropPath(self, key):
+        path = self.paths.pop(key, None)
+        if not path:
+            return None
+        columns = self.grid.columns
+        for r, c in path:
+            keys = self.cellPaths.get(r * columns + c)
+            if keys:
+                keys.discard(key)
+
+    def neighbours(self, index):
+        columns = self.grid.columns
+        column = index % columns
+        if column > 0:
+            yield index - 1
+        if column < columns - 1:
+            yield index + 1
+        if index >= columns:
+            yield index - columns
+        if index < len(self.walkable) - columns:
+            yield index + columns
+
+    ##### A* #####
+    def searchPath(self, start, goal):
+        """
+        A generator running an A* search from start to goal. It yields False
+        every searchStep expanded cells so the search can be spread across
+        frames, then yields the path: a list of (row, column) cells after
+        start up to and including goal, or None if goal can't be reached.
+        The start and goal cells don't need to be empty.
+        """
+        columns = self.grid.columns
+        walkable = self.walkable
+        size = len(walkable)
+        startIndex = start[0] * columns + start[1]
+        goalIndex = goal[0] * columns + goal[1]
+        goalRow, goalColumn = goal
+        cameFrom = array('i', [-1]) * size
+        cost = array('i', [-1]) * size
+        cost[startIndex] = 0
+        # ties are broken towards the goal, which saves a lot of expansions
+        frontier = [(0, 0, startIndex)]
+        heappush = heapq.heappush
+        heappop = heapq.heappop
+        step = self.searchStep
+        expanded = 0
+        found = startIndex == goalIndex
+        while frontier and not found:
+            estimate, heuristic, current = heappop(frontier)
+            if estimate - heuristic > cost[current]:
+                # stale entry for a cell already reached more cheaply
+                continue
+            expanded += 1
+            if expanded % step == 0:
+                yield False
+            newCost = cost[current] + 1
+            currentColumn = current % columns
+            for neighbour in (current - 1 if currentColumn > 0 else -1,
+                              current + 1 if currentColumn < columns - 1
+                              else -1,
+                              current - columns,
+                              current + columns):
+                if neighbour < 0 or neighbour >= size:
+                    continue
+                if not walkable[neighbour] and neighbour != goalIndex:
+                    continue
+                oldCost = cost[neighbour]
+                if oldCost == -1 or newCost < oldCost:
+                    cost[neighbour] = newCost
+                    cameFrom[neighbour] = current
+                    if neighbour == goalIndex:
+                        found = True
+                        break
+                    row, column = divmod(neighbour, columns)
+                    heuristic = abs(row - goalRow) + abs(column - goalColumn)
+                    heappush(frontier, (newCost + heuristic, heuristic,
+                                        neighbour))
+        if not found:
+            yield self.storePath(start, goal, None)
+            return
+        path = []
+        current = goalIndex
+        while current != startIndex:
+            path.append(divmod(current, columns))
+            current = cameFrom[current]
+        path.reverse()
+        yield self.storePath(start, goal, path)
+
+    def storePath(self, start, goal, path):
+        key = (tuple(start), tuple(goal))
+        self.paths[key] = path
+        if path:
+            columns = self.grid.columns
+            for r, c in path:
+                self.cellPaths.setdefault(r * columns + c, set()).add(key)
+        return path
+
+    def findPath(self, start, goal):
+        """
+        Returns the shortest path from start to goal, as a list of
+        (row, column) cells after start up to and including goal, or None
+        if there isn't one. Results are cached until a change affects them.
+        """
+        key = (tuple(start), tuple(goal))
+        if key in self.paths:
+            return self.paths[key]
+        result = None
+        for result in self.searchPath(start, goal):
+            pass
+        return result
+
+    def request(self, start, goal, callback):
+        """
+        Queues a path search. callback(path) is called by process once the
+        search is done, which is immediately if the path is cached.
+        """
+        key = (tuple(start), tuple(goal))
+        if key in self.paths:
+            callback(self.paths[key])
+            return None
+        self.requests.append((start, goal, callback))
+
+    def process(self, budget=2.0):
+        """
+        Repairs flow fields and works through queued path and flow field
+        requests for up to budget milliseconds. A path search is started again if walkability
+        changes before it finishes; a field build catches up with the
+        changes once it is done. Returns the number of requests still
+        waiting.
+        """
+        deadline = default_timer() + budget / 1000.0
+        self.repairFields(deadline=deadline)
+        while default_timer() < deadline:
+            if self.search is None:
+                if not self.requests:
+                    break
+                request = self.requests.popleft()
+                start, goal, callback = request
+                if start is None:
+                    field = self.fields.get(tuple(goal))
+                    if field is not None:
+                        self.fieldDone(goal, callback, field)
+                        continue
+                    self.search = (self.buildField(goal), request,
+                                   "resets", self.resets)
+                else:
+                    key = (tuple(start), tuple(goal))
+                    if key in self.paths:
+                        callback(self.paths[key])
+                        continue
+                    self.search = (self.searchPath(start, goal), request,
+                                   "changes", self.changes)
+            search, request, counter, count = self.search
+            if getattr(self, counter) != count:
+                # a path found could go through a newly blocked cell, and
+                # a field build can't catch up with a reset
+                search.close()
+                self.search = None
+                self.requests.appendleft(request)
+                continue
+            result = next(search)
+            if result is not False:
+                self.search = None
+                start, goal, callback = request
+                if start is None:
+                    self.fieldDone(goal, callback, result)
+                else:
+                    callback(result)
+        return len(self.requests) + (self.search is not None)
+
+    ##### FLOW FIELDS #####
+    def buildField(self, goal):
+        """
+        A generator building the flow field for goal. It yields False every
+        searchStep cells so the build can be spread across frames, then
+        yields the field. The build reads a copy of the walkability, and
+        cells that change meanwhile are left to be repaired.
+        """
+        key = tuple(goal)
+        columns = self.grid.columns
+        walkable = bytearray(self.walkable)
+        changed = set()
+        self.fieldBuilds.append(changed)
+        try:
+            field = array('i', [-1]) * len(walkable)
+            goalIndex = goal[0] * columns + goal[1]
+            field[goalIndex] = 0
+            queue = deque([goalIndex])
+            popleft = queue.popleft
+            append = queue.append
+            size = len(walkable)
+            step = self.searchStep
+            visited = 0
+            while queue:
+                current = popleft()
+                visited += 1
+                if visited % step == 0:
+                    yield False
+                distance = field[current] + 1
+                column = current % columns
+                for neighbour in (current - 1 if column > 0 else -1,
+                                  current + 1 if column < columns - 1 else -1,
+                                  current - columns,
+                                  current + columns):
+                    if (0 <= neighbour < size and walkable[neighbour] and
+                        field[neighbour] == -1):
+                        field[neighbour] = distance
+                        append(neighbour)
+        finally:
+            self.fieldBuilds = [other for other in self.fieldBuilds
+                                if other is not changed]
+        self.fields[key] = field
+        blocked = set(index for index in changed if not self.walkable[index])
+        self.fieldRepairs[key] = (walkable, blocked, changed - blocked)
+        yield field
+
+    def repairFields(self, goal=None, deadline=None):
+        """
+        Repairs the cells changed since a flow field was built, or since
+        every field was if goal is None. Returns False if it stopped at
+        deadline, leaving the rest for the next call. Cells that changed
+        back again are skipped.
+        """
+        keys = list(self.fields) if goal is None else [tuple(goal)]
+        columns = self.grid.columns
+        for key in keys:
+            field = self.fields[key]
+            walkable, blocked, freed = self.fieldRepairs[key]
+            goalIndex = key[0] * columns + key[1]
+            while True:
+                if deadline is not None and default_timer() >= deadline:
+                    return False
+                repair = self.repairing.get(key)
+                if repair is None or repair[0] is not field:
+                    # blocked cells first, so freed cells are only spread
+                    # from once, through the final walkability
+                    if blocked:
+                        index = blocked.pop()
+                    elif freed:
+                        index = freed.pop()
+                    else:
+                        break
+                    if walkable[index] == self.walkable[index]:
+                        continue
+                    walkable[index] = self.walkable[index]
+                    repair = (field, self.repairField(field, goalIndex, index,
+                                                      walkable))
+                    self.repairing[key] = repair
+                for done in repair[1]:
+                    if deadline is not None and default_timer() >= deadline:
+                        return False
+                del self.repairing[key]
+        return True
+
+    def repairField(self, field, goalIndex, index, walkable):
+        """
+        A generator updating a field after the cell at index has changed in
+        walkable, touching only the cells whose distances change. It yields
+        False every searchStep cells, so a repair can be spread across
+        frames.
+        """
+        if index == goalIndex:
+            # the goal is always distance 0, passable or not
+            return
+        if walkable[index]:
+            for done in self.relaxField(field, [index], walkable):
+                yield done
+            return
+        if field[index] == -1:
+            return
+        step = self.searchStep
+        visited = 0
+        # cells that have lost every route at their old distance, found a
+        # distance at a time so all of a cell's possible parents are
+        # already known
+        orphans = set([index])
+        level = [index]
+        while level:
+            candidates = set()
+            for current in level:
+                following = field[current] + 1
+                for neighbour in self.neighbours(current):
+                    if (field[neighbour] == following and
+                        neighbour not in orphans):
+                        candidates.add(neighbour)
+            level = []
+            for candidate in candidates:
+                visited += 1
+                if visited % step == 0:
+                    yield False
+                parent = field[candidate] - 1
+                for neighbour in self.neighbours(candidate):
+                    if field[neighbour] == parent and neighbour not in orphans:
+                        break
+                else:
+                    orphans.add(candidate)
+                    level.append(candidate)
+        for orphan in orphans:
+            field[orphan] = -1
+        orphans.discard(index)
+        for done in self.relaxField(field, orphans, walkable):
+            yield done
+
+    def relaxField(self, field, cells, walkable):
+        """
+        A generator giving each walkable cell in cells the distance of its
+        nearest neighbour plus one, and spreading any shorter distances
+        outwards
+        """
+        heap = []
+        for cell in cells:
+            if not walkable[cell]:
+                continue
+            best = -1
+            for neighbour in self.neighbours(cell):
+                distance = field[neighbour]
+                if distance != -1 and (best == -1 or distance < best):
+                    best = distance
+            if best != -1:
+                heapq.heappush(heap, (best + 1, cell))
+        step = self.searchStep
+        visited = 0
+        while heap:
+            distance, current = heapq.heappop(heap)
+            if field[current] != -1 and field[current] <= distance:
+                continue
+            visited += 1
+            if visited % step == 0:
+                yield False
+            field[current] = distance
+            for neighbour in self.neighbours(current):
+                if walkable[neighbour] and (field[neighbour] == -1 or
+                                            field[neighbour] > distance + 1):
+                    heapq.heappush(heap, (distance + 1, neighbour))
+
+    def flowField(self, goal):
+        """
+        Returns an array holding every cell's distance from goal in steps,
+        or -1 for cells that can't reach it. Many agents heading for the
+        same goal can share one field. Fields are cached, and repaired
+        before being returned. A field that isn't cached is built straight
+        away; use requestField to build it across frames instead.
+        """
+        field = self.fields.get(tuple(goal))
+        if field is not None:
+            self.repairFields(goal)
+            return field
+        for field in self.buildField(goal):
+            pass
+        return field
+
+    def requestField(self, goal, callback=None):
+        """
+        Queues a flow field build. callback(field) is called by process
+        once the field is built, which is immediately if it is cached.
+        """
+        key = tuple(goal)
+        field = self.fields.get(key)
+        if field is not None:
+            if callback:
+                callback(field)
+            return None
+        if callback is None and key in self.pendingFields:
+            return None
+        self.pendingFields.add(key)
+        self.requests.append((None, goal, callback))
+
+    def fieldDone(self, goal, callback, field):
+        self.pendingFields.discard(tuple(goal))
+        if callback:
+            callback(field)
+
+    def nextStep(self, goal, cell, wait=True):
+        """
+        Returns the neighbouring cell that takes cell one step closer to
+        goal along the flow field, or None if there isn't one. If wait is
+        False the field isn't built or repaired here: until process has
+        built it None is returned, and until process has repaired it the
+        step may lead into a cell that has just been filled.
+        """
+        if wait:
+            field = self.flowField(goal)
+        else:
+            field = self.fields.get(tuple(goal))
+            if field is None:
+                self.requestField(goal)
+                return None
+        columns = self.grid.columns
+        index = cell[0] * columns + cell[1]
+        best = None
+        bestDistance = field[index]
+        for neighbour in self.neighbours(index):
+            distance = field[neighbour]
+            if distance != -1 and (bestDistance == -1 or
+                                   distance < bestDistance):
+                best = neighbour
+                bestDistance = distance
+        if best is None:
+            return None
+        return divmod(best, columns)
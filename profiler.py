@@ -0,0 +1,187 @@
+from array import array
+from timeit import default_timer
+import json
+
+PHASES = ("input", "update", "render", "flip")
+
+class FrameProfiler(object):
+    """
+    Records how long each phase of a frame takes, in milliseconds, in a
+    ring buffer holding the most recent frames.
+    """
+    def __init__(self, size=600, phases=PHASES):
+        self.size = size
+        self.phases = phases
+        self.timings = dict((phase, array('d', [0.0]) * size)
+                            for phase in phases)
+        self.totals = array('d', [0.0]) * size
+        self.index = 0
+        self.count = 0
+        self.current = dict((phase, 0.0) for phase in phases)
+        self.phaseStart = None
+        self.frameStart = None
+
+    def startFrame(self):
+        self.frameStart = default_timer()
+        self.phaseStart = self.frameStart
+
+    def mark(self, phase):
+        """
+        Records the time since the previous mark, or the start of the frame,
+        against a phase
+        """
+        now = default_timer()
+        self.current[phase] += (now - self.phaseStart) * 1000
+        self.phaseStart = now
+
+    def endFrame(self):
+        """
+        Stores the current frame's timings in the ring buffer
+        """
+        for phase in self.phases:
+            self.timings[phase][self.index] = self.current[phase]
+            self.current[phase] = 0.0
+        self.totals[self.index] = (default_timer() - self.frameStart) * 1000
+        self.index = (self.index + 1) % self.size
+        self.count = min(self.count + 1, self.size)
+
+    def frames(self, n=None):
+        """
+        Returns the timings of the last n frames, oldest first, as a list
+        of dictionaries
+        """
+        if n is None or n > self.count:
+            n = self.count
+        frames = []
+        for back in range(n, 0, -1):
+            index = (self.index - back) % self.size
+            frame = dict((phase, self.timings[phase][index])
+                         for phase in self.phases)
+            frame["total"] = self.totals[index]
+            frames.append(frame)
+        return frames
+
+    def average(self, phase="total", n=None):
+        """
+        Returns the mean time of a phase over the last n frames
+        """
+        frames = self.frames(n)
+        if not frames:
+            return 0.0
+        return sum(frame[phase] for frame in frames) / len(frames)
+
+    def dump(self, filename, n=None):
+        """
+        Writes the last n frames to a CSV file
+        """
+        columns = list(self.phases) + ["total"]
+        with open(filename, "w") as output:
+            output.write(",".join(columns) + "\n")
+            for frame in self.frames(n):
+                output.write(",".join("%.3f" % frame[column]
+                                      for column in columns) + "\n")
+
+COUNTERS = ("blits", "displayUpdates", "assetLoads", "fontRenders",
+            "soundDecodes")
+
+class Instrumentation(object):
+    """
+    Counts and times the engine's expensive operations frame by frame,
+    keeping the last size frames of each counter. The engine only calls
+    into this when instrumentation is enabled.
+    """
+    def __init__(self, size=300, counters=COUNTERS):
+        self.size = size
+        self.counters = counters
+        self.counts = dict((name, array('d', [0.0]) * size)
+                           for name in counters)
+        self.times = dict((name, array('d', [0.0]) * size)
+                          for name in counters)
+        self.frameTimes = array('d', [0.0]) * size
+        self.currentCounts = dict((name, 0) for name in counters)
+        self.currentTimes = dict((name, 0.0) for name in counters)
+        self.index = 0
+        self.frames = 0
+        self.lastFrame = default_timer()
+
+    def count(self, name, n=1, elapsed=0.0):
+        """
+        Adds n to a counter for this frame, and elapsed milliseconds to
+        its time
+        """
+        self.currentCounts[name] += n
+        self.currentTimes[name] += elapsed
+
+    def endFrame(self):
+        now = default_timer()
+        index = self.index
+        for name in self.counters:
+            self.counts[name][index] = self.currentCounts[name]
+            self.times[name][index] = self.currentTimes[name]
+            self.currentCounts[name] = 0
+            self.currentTimes[name] = 0.0
+        self.frameTimes[index] = (now - self.lastFrame) * 1000
+        self.lastFrame = now
+        self.index = (index + 1) % self.size
+        self.frames = min(self.frames + 1, self.size)
+
+    def recent(self, values, n=None):
+        """
+        Returns the last n values of a ring buffer, oldest first
+        """
+        if n is None or n > self.frames:
+            n = self.frames
+        return [values[(self.index - back) % self.size]
+                for back in range(n, 0, -1)]
+
+    def fps(self, n=30):
+        times = self.recent(self.frameTimes, n)
+        if not times or not sum(times):
+            return 0.0
+        return 1000.0 * len(times) / sum(times)
+
+    def histogram(self, name=None, bins=10, n=None):
+        """
+        Returns (edges, counts) of a histogram of frame times, or of a
+        counter's per-frame values if name is given
+        """
+        if name is None:
+            values = self.recent(self.frameTimes, n)
+        else:
+            values = self.recent(self.counts[name], n)
+        if not values:
+            return [], []
+        low = min(values)
+        width = (max(values) - low) / float(bins) or 1.0
+        counts = [0] * bins
+        for value in values:
+            counts[min(bins - 1, int((value - low) / width))] += 1
+        edges = [low + width * n for n in range(bins + 1)]
+        return edges, counts
+
+    def export(self, filename, caches=None):
+        """
+        Writes the recorded frames to a .json or .csv file. caches is an
+        optional dictionary of LRUCache stats to include in JSON exports.
+        """
+        frames = []
+        for back in range(self.frames, 0, -1):
+            index = (self.index - back) % self.size
+            frame = {"frameTime": self.frameTimes[index]}
+            for name in self.counters:
+                frame[name] = self.counts[name][index]
+                frame[name + "Time"] = self.times[name][index]
+            frames.append(frame)
+        if filename.endswith(".json"):
+            with open(filename, "w") as output:
+                json.dump({"frames": frames, "caches": caches or {}}, output,
+                          indent=1)
+            return None
+        columns = ["frameTime"]
+        for name in self.counters:
+            columns += [name, name + "Time"]
+        with open(filename, "w") as output:
+            output.write(",".join(columns) + "\n")
+            for frame in frames:
+                output.write(",".join("%.3f" % frame[column]
+                                      for column in columns) + "\n")
@@ -0,0 +1,229 @@
+"""
+Saving and loading Greasy Grids.
+
+A snapshot file is a header, a JSON manifest describing the object for
+each of the grid's item IDs, and the grid's int32 cell IDs, optionally
+zlib compressed. Delta snapshots store only the cells that changed since a
+base copy of the cells, for autosaves and undo.
+"""
+import grid as g
+from array import array
+import json, struct, threading, zlib
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MAGIC = b"GRSN"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIII")
+# flags
+COMPRESSED = 1
+DELTA = 2
+
+def copyCells(grid):
+    """
+    Returns a copy of a grid's cell IDs, to use as the base of a delta
+    """
+    return grid.cells[:]
+
+def manifest(grid, names):
+    """
+    Returns the manifest entry for every item ID of a grid. names(item)
+    returns a JSON-compatible entry for any object that isn't one itself.
+    Only the items in the grid's cells are named; other IDs are saved as
+    None.
+    """
+    if numpy is not None:
+        # counting doesn't sort, so it stays cheap on big grids
+        used = numpy.bincount(numpy.frombuffer(grid.cells, dtype=numpy.int32),
+                              minlength=len(grid.items)).tolist()
+    else:
+        used = [0] * len(grid.items)
+        for itemId in set(grid.cells):
+            used[itemId] = 1
+    entries = []
+    for itemId, item in enumerate(grid.items):
+        if itemId and not used[itemId]:
+            entries.append({"value": None})
+        elif item is None or isinstance(item, (int, float, basestring)):
+            entries.append({"value": item})
+        else:
+            entries.append({"asset": names(item)})
+    return entries
+
+def changedCells(cells, base):
+    """
+    Returns (indices, ids) arrays of the cells that differ from base
+    """
+    if numpy is not None:
+        current = numpy.frombuffer(cells, dtype=numpy.int32)
+        previous = numpy.frombuffer(base, dtype=numpy.int32)
+        changed = numpy.flatnonzero(current != previous).astype(numpy.int32)
+        indices = array('i')
+        indices.fromstring(changed.tobytes())
+        ids = array('i')
+        ids.fromstring(current[changed].tobytes())
+        return indices, ids
+    indices = array('i')
+    ids = array('i')
+    for index, (new, old) in enumerate(zip(cells, base)):
+        if new != old:
+            indices.append(index)
+            ids.append(new)
+    return indices, ids
+
+def writeSnapshot(filename, rows, columns, cells, entries, flags, base=None):
+    """
+    Writes cells, or just those that differ from base, with a manifest
+    from manifest()
+    """
+    if base is None:
+        payload = cells.tostring()
+    else:
+        indices, ids = changedCells(cells, base)
+        payload = (struct.pack("<I", len(indices)) + indices.tostring() +
+                   ids.tostring())
+        flags |= DELTA
+    if flags & COMPRESSED:
+        payload = zlib.compress(payload, 1)
+    manifestData = json.dumps(entries).encode("utf-8")
+    with open(filename, "wb") as output:
+        output.write(HEADER.pack(MAGIC, VERSION, rows, columns, flags,
+                                 len(manifestData)))
+        output.write(manifestData)
+        output.write(payload)
+
+def saveGrid(filename, grid, names, compress=False, base=None):
+    """
+    Writes a grid to a snapshot file.
+
+    Parameters
+    ----------
+    filename: string
+        snapshot filename
+    grid: Greasy Grid
+        grid to save
+    names: function
+        names(item) returns a JSON-compatible description of an item that
+        isn't a number, string or None, such as a surface's asset filename
+    compress: bool, optional, default=False
+        zlib compress the cells
+    base: array, optional, default=None
+        cells from copyCells. If given, only the cells that differ from
+        base are saved.
+    """
+    flags = COMPRESSED if compress else 0
+    writeSnapshot(filename, grid.rows, grid.columns, grid.cells,
+                  manifest(grid, names), flags, base)
+
+def saveGridAsync(filename, grid, names, compress=False, base=None):
+    """
+    Like saveGrid, but only copies the grid's cells on the calling thread.
+    The file is written on a background thread, which is returned.
+    """
+    flags = COMPRESSED if compress else 0
+    thread = threading.Thread(target=writeSnapshot,
+                              args=(filename, grid.rows, grid.columns,
+                                    copyCells(grid), manifest(grid, names),
+                                    flags, base))
+    thread.start()
+    return thread
+
+def resolveItems(entries, resolve):
+    items = []
+    for entry in entries:
+        if "asset" in entry:
+            items.append(resolve(entry["asset"]))
+            continue
+        value = entry["value"]
+        if isinstance(value, unicode):
+            # json returns every string as unicode, but the grid keys
+            # items by type, so plain strings must come back as str
+            try:
+                value = value.encode("ascii")
+            except UnicodeEncodeError:
+                pass
+        items.append(value)
+    return items
+
+def checkRange(values, limit, filename):
+    """
+    Raises ValueError unless every value is from 0 to limit - 1
+    """
+    if not len(values):
+        return None
+    if numpy is not None:
+        values = numpy.frombuffer(values, dtype=numpy.int32)
+        low, high = int(values.min()), int(values.max())
+    else:
+        low, high = min(values), max(values)
+    if low < 0 or high >= limit:
+        raise ValueError("%s refers to cells or items that don't exist" %
+                         filename)
+
+def loadGrid(filename, resolve, grid=None):
+    """
+    Loads a snapshot. resolve(entry) turns each asset entry written by
+    names back into an object. A full snapshot returns a new Grid, or
+    replaces the contents of grid if it is given. A delta snapshot is
+    applied on top of grid, which must be given, and replaces its side
+    table with the saved one. Raises ValueError if grid is a different
+    size from the snapshot.
+    """
+    with open(filename, "rb") as source:
+        (magic, version, rows, columns, flags,
+         manifestLength) = HEADER.unpack(source.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a Greasy snapshot" % filename)
+        if grid is not None and (rows, columns) != (grid.rows, grid.columns):
+            raise ValueError("%s is %dx%d, but the grid is %dx%d" %
+                             (filename, rows, columns, grid.rows,
+                              grid.columns))
+        entries = json.loads(source.read(manifestLength).decode("utf-8"))
+        if flags & (COMPRESSED | DELTA):
+            payload = source.read()
+        else:
+            # read straight into the array, without an intermediate string
+            cells = array('i')
+            try:
+                cells.fromfile(source, rows * columns)
+            except EOFError:
+                raise ValueError("%s is truncated" % filename)
+    items = resolveItems(entries, resolve)
+    if flags & COMPRESSED:
+        payload = zlib.decompress(payload)
+    if flags & DELTA:
+        if grid is None:
+            raise ValueError("a delta snapshot needs a grid to apply to")
+        count = struct.unpack("<I", payload[:4])[0]
+        if len(payload) != 4 + count * 8:
+            raise ValueError("%s is truncated" % filename)
+        indices = array('i')
+        indices.fromstring(payload[4:4 + count * 4])
+        ids = array('i')
+        ids.fromstring(payload[4 + count * 4:4 + count * 8])
+        checkRange(indices, rows * columns, filename)
+        checkRange(ids, len(items), filename)
+        if numpy is not None:
+            view = numpy.frombuffer(grid.cells, dtype=numpy.int32)
+            view[numpy.frombuffer(indices, dtype=numpy.int32)] = \
+                numpy.frombuffer(ids, dtype=numpy.int32)
+        else:
+            cells = grid.cells
+            for index, itemId in zip(indices, ids):
+                cells[index] = itemId
+        # after the cells, so observers see the finished grid
+        grid.setContents(None, items)
+        return grid
+    if flags & COMPRESSED:
+        cells = array('i')
+        cells.fromstring(payload)
+    if len(cells) != rows * columns:
+        raise ValueError("%s is truncated" % filename)
+    checkRange(cells, len(items), filename)
+    if grid is None:
+        grid = g.Grid(rows, columns)
+    grid.setContents(cells, items)
+    return grid
@@ -1,48 +1,168 @@
-import pygame
+import cache as c
+import pygame, time
+
+def soundBytes(sound):
+    """
+    Returns the approximate memory used by a decoded pygame sound
+    """
+    frequency, size, channels = pygame.mixer.get_init()
+    return int(sound.get_length() * frequency * channels * abs(size) // 8)
 
 class SoundHandler():
-    def __init__(self, channels=8):
+    def __init__(self, channels=8, soundBudget=32 * 1024 * 1024):
         pygame.mixer.init()
-        self.backgroundChannel = pygame.mixer.find_channel()
-        self.backgroundMusic = None
-        self.currentSounds = {}
+        # channel 0 is reserved for background music, the rest are pooled
         self.numChannels = channels
         pygame.mixer.set_num_channels(channels)
+        pygame.mixer.set_reserved(1)
+        self.backgroundChannel = pygame.mixer.Channel(0)
+        self.channels = [pygame.mixer.Channel(n) for n in range(1, channels)]
+        self.priorities = [0] * len(self.channels)
+        self.started = [0] * len(self.channels)
+        self.backgroundMusic = None
+        self.currentSounds = {}
+        # decoded sound bank
+        self.sounds = c.LRUCache(budget=soundBudget)
+        self.decodeTimes = {}
+        self.decodeTimeSaved = 0.0
+        self.voicesStolen = 0
+        self.voicesDropped = 0
+        # a profiler.Instrumentation counting decodes, if enabled
+        self.stats = None
     
     def testChannels(self, increase=1):
         """
         Test if all the channels are active, optionally increasing the number of
         channels if they are all active.
         """
-        if pygame.mixer.get_num_channels() == self.numChannels:
-            if increase != 0:
-                pygame.mixer.set_num_channels(self.numChannels + increase)
-            return True
-        else:
-            return False
+        for channel in self.channels:
+            if not channel.get_busy():
+                return False
+        if increase > 0:
+            self.numChannels += increase
+            pygame.mixer.set_num_channels(self.numChannels)
+            for n in range(len(self.channels) + 1, self.numChannels):
+                self.channels.append(pygame.mixer.Channel(n))
+                self.priorities.append(0)
+                self.started.append(0)
+        return True
+    
+    def getChannel(self, priority=0):
+        """
+        Returns a free channel from the pool. If every channel is busy, the
+        oldest sound with the lowest priority no higher than priority is
+        stopped and its channel returned. Returns None, and counts a dropped
+        voice, if every playing sound has a higher priority.
+        """
+        for n, channel in enumerate(self.channels):
+            if not channel.get_busy():
+                return self.claimChannel(n, priority)
+        victim = None
+        for n in range(len(self.channels)):
+            if self.priorities[n] > priority:
+                continue
+            if (victim is None or
+                (self.priorities[n], self.started[n]) <
+                (self.priorities[victim], self.started[victim])):
+                victim = n
+        if victim is None:
+            self.voicesDropped += 1
+            return None
+        self.channels[victim].stop()
+        self.voicesStolen += 1
+        return self.claimChannel(victim, priority)
+
+    def claimChannel(self, n, priority):
+        """
+        Gives pooled channel n to a new sound, forgetting the sound it was
+        remembered as playing
+        """
+        channel = self.channels[n]
+        self.priorities[n] = priority
+        self.started[n] = pygame.time.get_ticks()
+        self.forgetChannel(channel)
+        return channel
+
+    def forgetChannel(self, channel):
+        for filename, current in self.currentSounds.items():
+            if current == channel:
+                del self.currentSounds[filename]
+
+    def reuseChannel(self, channel, priority=0, filename=None):
+        """
+        Returns the pooled channel a sound was last played on, to play it
+        again. Returns None, and counts a dropped voice, if it is now
+        playing a sound with a higher priority. Restarting the sound
+        itself isn't counted as a stolen voice.
+        """
+        n = self.channels.index(channel)
+        if channel.get_busy():
+            if self.priorities[n] > priority:
+                self.voicesDropped += 1
+                return None
+            # an evicted sound can't be compared, but the channel is still
+            # remembered as playing it
+            sound = self.sounds.entries.get(filename, filename)
+            if (not isinstance(sound, basestring) and
+                channel.get_sound() is not sound):
+                self.voicesStolen += 1
+            channel.stop()
+        return self.claimChannel(n, priority)
     
     def loadSound(self, filename):
         """
-        Return a pygame sound
+        Return a pygame sound. Each file is decoded once and kept in
+        self.sounds until it is evicted.
+        """
+        sound = self.sounds.get(filename)
+        if sound is not None:
+            self.decodeTimeSaved += self.decodeTimes.get(filename, 0.0)
+            return sound
+        start = time.time()
+        sound = pygame.mixer.Sound(filename)
+        self.addSound(filename, sound, time.time() - start)
+        return sound
+
+    def addSound(self, filename, sound, decodeTime=0.0):
+        """
+        Adds a sound decoded elsewhere, such as by a loader thread, to the
+        sound bank
         """
-        return pygame.mixer.Sound(filename)
+        self.decodeTimes[filename] = decodeTime
+        if self.stats:
+            self.stats.count("soundDecodes", 1, decodeTime * 1000)
+        self.sounds.put(filename, sound, soundBytes(sound))
     
-    def playSound(self, filename, channel=None, loops=0, save=True, test=True):
+    def preloadSounds(self, filenames):
         """
-        Play a sound on a new channel or on an existing channel if the sound has been played before
+        Decodes a list of sound files into the sound bank
+        """
+        for filename in filenames:
+            self.loadSound(filename)
+    
+    def playSound(self, filename, channel=None, loops=0, save=True, test=True,
+                  priority=0):
+        """
+        Play a sound on a new channel or on an existing channel if the sound has been played before.
+        New channels come from the channel pool, stealing a lower priority
+        voice if necessary. A sound played again on its old channel gets
+        the same priority check. The test argument is kept for compatibility;
+        the pool never allocates extra mixer channels while playing.
         """
         if not channel:
-            if filename in self.currentSounds:
-                channel = self.currentSounds[filename]
-            else:
-                if test:
-                    self.testChannels()
-                    channel = pygame.mixer.find_channel()
-                else:
-                    channel = pygame.mixer.find_channel()
-        try:
-            currentSound = self.loadSound(filename)
-        except pygame.error:
+            channel = self.currentSounds.get(filename)
+            if channel in self.channels:
+                channel = self.reuseChannel(channel, priority, filename)
+            elif channel is None:
+                channel = self.getChannel(priority)
+            if channel is None:
+                return None
+        if isinstance(filename, basestring):
+            try:
+                currentSound = self.loadSound(filename)
+            except pygame.error:
+                currentSound = filename
+        else:
             currentSound = filename
         try:
             channel.play(currentSound, loops)
@@ -50,7 +170,19 @@ class SoundHandler():
             print "Error playing sound. File is of type ", type(currentSound)
             return None
         if save:
+            self.forgetChannel(channel)
             self.currentSounds[filename] = channel
+
+    def soundStats(self):
+        """
+        Returns a dictionary of the sound bank and channel pool counters
+        """
+        stats = self.sounds.stats()
+        stats["decodeTimeSaved"] = self.decodeTimeSaved
+        stats["voicesStolen"] = self.voicesStolen
+        stats["voicesDropped"] = self.voicesDropped
+        return stats
+
     def loopSound(self, filename, channel=None, loops=-1, save=True):
         """
         Loop a sound a specified number of times
@@ -109,7 +241,7 @@ class SoundHandler():
         """
         play background music on dedicated background channel
         """
-        if filename or self.backgroundMusic:
+        if filename:
             self.loadBackgroundMusic(filename)
         try:
             self.playSound(self.backgroundMusic, channel=self.backgroundChannel, save=False)
@@ -120,7 +252,7 @@ class SoundHandler():
         """
         loop playback of background music on dedicated background channel
         """
-        if filename or self.backgroundMusic:
+        if filename:
             self.loadBackgroundMusic(filename)
         self.loopSound(self.backgroundMusic, channel=self.backgroundChannel, loops=loops, save=False)
     
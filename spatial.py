@@ -0,0 +1,130 @@
+class SpatialHash(object):
+    """
+    A uniform grid of buckets for finding entities by position. Positions
+    are (x, y) cell coordinates. Each bucket covers bucketSize x bucketSize
+    cells, so queries only look at the buckets they overlap.
+    """
+    def __init__(self, bucketSize=8):
+        self.bucketSize = bucketSize
+        self.buckets = {}
+        self.positions = {}
+
+    def bucket(self, position):
+        return (int(position[0] // self.bucketSize),
+                int(position[1] // self.bucketSize))
+
+    def insert(self, entity, position):
+        if entity in self.positions:
+            self.remove(entity)
+        self.positions[entity] = position
+        self.buckets.setdefault(self.bucket(position), set()).add(entity)
+
+    def remove(self, entity):
+        position = self.positions.pop(entity)
+        key = self.bucket(position)
+        bucket = self.buckets[key]
+        bucket.discard(entity)
+        if not bucket:
+            del self.buckets[key]
+
+    def move(self, entity, position):
+        """
+        Updates an entity's position, only touching the buckets if it has
+        crossed into a different one
+        """
+        oldKey = self.bucket(self.positions[entity])
+        newKey = self.bucket(position)
+        self.positions[entity] = position
+        if oldKey != newKey:
+            bucket = self.buckets[oldKey]
+            bucket.discard(entity)
+            if not bucket:
+                del self.buckets[oldKey]
+            self.buckets.setdefault(newKey, set()).add(entity)
+
+    def position(self, entity):
+        return self.positions.get(entity)
+
+    def __contains__(self, entity):
+        return entity in self.positions
+
+    def queryPoint(self, position):
+        """
+        Returns a list of the entities at a position
+        """
+        bucket = self.buckets.get(self.bucket(position), ())
+        positions = self.positions
+        return [entity for entity in bucket if positions[entity] == position]
+
+    def queryRect(self, left, top, right, bottom):
+        """
+        Returns a list of the entities with left <= x <= right and
+        top <= y <= bottom
+        """
+        firstX, firstY = self.bucket((left, top))
+        lastX, lastY = self.bucket((right, bottom))
+        positions = self.positions
+        found = []
+        for bx in range(firstX, lastX + 1):
+            for by in range(firstY, lastY + 1):
+                for entity in self.buckets.get((bx, by), ()):
+                    x, y = positions[entity]
+                    if left <= x <= right and top <= y <= bottom:
+                        found.append(entity)
+        return found
+
+    def queryRadius(self, centre, radius):
+        """
+        Returns a list of the entities within radius of centre
+        """
+        cx, cy = centre
+        limit = radius * radius
+        positions = self.positions
+        found = []
+        for entity in self.queryRect(cx - radius, cy - radius,
+                                     cx + radius, cy + radius):
+            x, y = positions[entity]
+            if (x - cx) ** 2 + (y - cy) ** 2 <= limit:
+                found.append(entity)
+        return found
+
+    def nearest(self, centre, k=1):
+        """
+        Returns a list of up to k entities closest to centre, nearest first.
+        Buckets are searched in rings outwards from centre, stopping once
+        no unsearched bucket can hold anything closer.
+        """
+        if not self.positions:
+            return []
+        cx, cy = centre
+        bx, by = self.bucket(centre)
+        positions = self.positions
+        size = self.bucketSize
+        total = len(positions)
+        found = []
+        ring = 0
+        while len(found) < total:
+            if ring == 0:
+                ringKeys = [(bx, by)]
+            else:
+                ringKeys = [(bx + dx, by - ring)
+                            for dx in range(-ring, ring + 1)]
+                ringKeys += [(bx + dx, by + ring)
+                             for dx in range(-ring, ring + 1)]
+                ringKeys += [(bx - ring, by + dy)
+                             for dy in range(-ring + 1, ring)]
+                ringKeys += [(bx + ring, by + dy)
+                             for dy in range(-ring + 1, ring)]
+            for key in ringKeys:
+                for entity in self.buckets.get(key, ()):
+                    x, y = positions[entity]
+                    found.append(((x - cx) ** 2 + (y - cy) ** 2, entity))
+            if len(found) >= k:
+                found.sort(key=lambda pair: pair[0])
+                # anything in the next ring is at least this far away
+                reach = ring * size
+                if found[k - 1][0] <= reach * reach:
+                    break
+            ring += 1
+        found.sort(key=lambda pair: pair[0])
+        return [entity for distance, entity in found[:k]]
@@ -0,0 +1,305 @@
+"""
+Chunked world files for maps too large to hold in memory.
+
+A world file is a header, a JSON manifest naming each tile ID's asset, and
+then the tile IDs of every chunk as int32 values. Chunks are
+chunkSize x chunkSize cells stored one after another, so any chunk can be
+read straight out of a memory map. Tile ID 0 is always empty.
+"""
+import cache as c
+from array import array
+import json, mmap, struct, threading, Queue
+
+MAGIC = b"GRWD"
+VERSION = 1
+HEADER = struct.Struct("<4sIIIII")
+
+def createWorld(filename, rows, columns, chunkSize=32, manifest=()):
+    """
+    Creates an empty world file. manifest lists the asset for each tile ID
+    from 1 upwards, as a filename or a list of newObject arguments.
+    """
+    manifestData = json.dumps(list(manifest)).encode("utf-8")
+    # keep the chunk data 4-byte aligned
+    manifestData += b" " * (-(HEADER.size + len(manifestData)) % 4)
+    chunkRows = -(-rows // chunkSize)
+    chunkColumns = -(-columns // chunkSize)
+    dataSize = chunkRows * chunkColumns * chunkSize * chunkSize * 4
+    with open(filename, "wb") as output:
+        output.write(HEADER.pack(MAGIC, VERSION, chunkSize, rows, columns,
+                                 len(manifestData)))
+        output.write(manifestData)
+        # the file is extended without writing, so untouched chunks are empty
+        output.truncate(HEADER.size + len(manifestData) + dataSize)
+
+def saveWorld(filename, grid, names, chunkSize=32):
+    """
+    Writes a Greasy Grid to a world file. names(item) returns the manifest
+    entry for each non-empty item in the grid.
+    """
+    manifest = []
+    entries = {}
+    # grid side table ID -> world tile ID
+    remap = [0] * len(grid.items)
+    used = set(grid.cells)
+    for itemId, item in enumerate(grid.items):
+        if itemId == 0 or itemId not in used:
+            continue
+        entry = names(item)
+        key = json.dumps(entry)
+        if key not in entries:
+            manifest.append(entry)
+            entries[key] = len(manifest)
+        remap[itemId] = entries[key]
+    createWorld(filename, grid.rows, grid.columns, chunkSize, manifest)
+    world = World(filename, writable=True)
+    for chunkRow in range(world.chunkRows):
+        for chunkColumn in range(world.chunkColumns):
+            chunk = array('i', [0]) * (chunkSize * chunkSize)
+            firstRow = chunkRow * chunkSize
+            firstColumn = chunkColumn * chunkSize
+            lastColumn = min(firstColumn + chunkSize, grid.columns)
+            for r in range(firstRow, min(firstRow + chunkSize, grid.rows)):
+                start = r * grid.columns
+                offset = (r - firstRow) * chunkSize
+                for c in range(firstColumn, lastColumn):
+                    chunk[offset + c - firstColumn] = remap[grid.cells[start + c]]
+            world.writeChunk(chunkRow, chunkColumn, chunk)
+    world.close()
+
+class World(object):
+    """
+    A memory-mapped world file
+    """
+    def __init__(self, filename, writable=False):
+        self.filename = filename
+        self.writable = writable
+        if writable:
+            self.file = open(filename, "r+b")
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_WRITE)
+        else:
+            self.file = open(filename, "rb")
+            self.map = mmap.mmap(self.file.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+        (magic, version, self.chunkSize, self.rows, self.columns,
+         manifestLength) = HEADER.unpack(self.map[:HEADER.size])
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a Greasy world file" % filename)
+        manifestData = self.map[HEADER.size:HEADER.size + manifestLength]
+        self.manifest = json.loads(manifestData.decode("utf-8"))
+        self.dataOffset = HEADER.size + manifestLength
+        self.chunkRows = -(-self.rows // self.chunkSize)
+        self.chunkColumns = -(-self.columns // self.chunkSize)
+        self.chunkBytes = self.chunkSize * self.chunkSize * 4
+
+    def chunkOffset(self, chunkRow, chunkColumn):
+        return (self.dataOffset +
+                (chunkRow * self.chunkColumns + chunkColumn) * self.chunkBytes)
+
+    def readChunk(self, chunkRow, chunkColumn):
+        """
+        Returns the tile IDs of a chunk as an array, row by row
+        """
+        offset = self.chunkOffset(chunkRow, chunkColumn)
+        chunk = array('i')
+        chunk.fromstring(self.map[offset:offset + self.chunkBytes])
+        return chunk
+
+    def writeChunk(self, chunkRow, chunkColumn, chunk):
+        offset = self.chunkOffset(chunkRow, chunkColumn)
+        self.map[offset:offset + self.chunkBytes] = chunk.tostring()
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class StreamedGrid(object):
+    """
+    A grid backed by a world file. Only the chunks around the focus are
+    held in memory, in an LRU cache of at most maxChunks chunks. Chunks
+    are read on a background thread and added to the grid a few at a
+    time by update, so loading never stalls the caller. Supports the
+    getItem/setItem part of the Grid interface; cells in chunks that
+    aren't loaded read as empty.
+    
+    Items outside the world's manifest, such as a player, get IDs for this
+    session only. Cells holding them are written to the file as empty and
+    restored when their chunk is read again.
+    """
+    def __init__(self, world, tiles, maxChunks=64, assetKey=None):
+        """
+        Parameters
+        ----------
+        world: World
+            the world file
+        tiles: list
+            the object for each tile ID, starting with the empty value
+        maxChunks: int, optional, default=64
+            most chunks held in memory
+        assetKey: function, optional, default=None
+            returns a hashable key naming an item's asset, or None. Tiles
+            are matched by this key, so a tile reloaded as a new object
+            keeps its ID.
+        """
+        self.world = world
+        self.rows = world.rows
+        self.columns = world.columns
+        self.chunkSize = world.chunkSize
+        self.assetKey = assetKey
+        self.items = list(tiles)
+        self.tileCount = len(tiles)
+        self.ids = {}
+        for itemId, item in enumerate(tiles):
+            self.ids[self.itemKey(item)] = itemId
+        # session-only IDs of evicted chunks, by chunk and cell offset
+        self.extras = {}
+        self.chunks = c.LRUCache(maxItems=maxChunks,
+                                 onEvict=self.writeBack)
+        self.modified = set()
+        self.pending = set()
+        # pending chunks read by setItem since they were requested
+        self.stale = set()
+        self.requests = Queue.Queue()
+        self.loaded = Queue.Queue()
+        self.thread = threading.Thread(target=self.load)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def load(self):
+        """
+        Background thread reading requested chunks
+        """
+        while True:
+            key = self.requests.get()
+            if key is None:
+                return None
+            self.loaded.put((key, self.world.readChunk(*key)))
+
+    def itemKey(self, item):
+        """
+        Returns the key an item's ID is stored under
+        """
+        if self.assetKey:
+            key = self.assetKey(item)
+            if key is not None:
+                return ("asset", key)
+        return ("id", id(item))
+
+    def itemId(self, item):
+        """
+        Returns an item's ID, adding items outside the manifest to the side
+        table
+        """
+        key = self.itemKey(item)
+        itemId = self.ids.get(key)
+        if itemId is None:
+            itemId = len(self.items)
+            self.items.append(item)
+            self.ids[key] = itemId
+        return itemId
+
+    def restoreItems(self, key, chunk):
+        """
+        Restores the session-only IDs of a chunk read from the file
+        """
+        for offset, itemId in self.extras.get(key, {}).items():
+            chunk[offset] = itemId
+        return chunk
+
+    def writeBack(self, key, chunk):
+        if key in self.modified:
+            self.modified.discard(key)
+            if not self.world.writable:
+                return None
+            extras = {}
+            if len(self.items) > self.tileCount:
+                for offset, itemId in enumerate(chunk):
+                    if itemId >= self.tileCount:
+                        extras[offset] = itemId
+            if extras:
+                self.extras[key] = extras
+                chunk = array("i", chunk)
+                for offset in extras:
+                    chunk[offset] = 0
+            else:
+                self.extras.pop(key, None)
+            self.world.writeChunk(key[0], key[1], chunk)
+
+    def update(self, focus, radius=1, maxApply=2):
+        """
+        Requests the chunks within radius chunks of the focus cell, and adds
+        up to maxApply loaded chunks to the grid. Returns the number of
+        chunks added.
+        """
+        size = self.chunkSize
+        focusRow = focus[0] // size
+        focusColumn = focus[1] // size
+        for chunkRow in range(max(0, focusRow - radius),
+                              min(self.world.chunkRows, focusRow + radius + 1)):
+            for chunkColumn in range(max(0, focusColumn - radius),
+                                     min(self.world.chunkColumns,
+                                         focusColumn + radius + 1)):
+                key = (chunkRow, chunkColumn)
+                # get also marks resident chunks as recently used
+                if (self.chunks.get(key) is None and
+                    key not in self.pending):
+                    self.pending.add(key)
+                    self.requests.put(key)
+        applied = 0
+        while applied < maxApply:
+            try:
+                key, chunk = self.loaded.get_nowait()
+            except Queue.Empty:
+                break
+            self.pending.discard(key)
+            if key in self.stale:
+                # read before setItem loaded and changed the chunk
+                self.stale.discard(key)
+                continue
+            if key not in self.chunks:
+                self.chunks.put(key, self.restoreItems(key, chunk))
+            applied += 1
+        return applied
+
+    def getItem(self, row, column):
+        size = self.chunkSize
+        chunk = self.chunks.entries.get((row // size, column // size))
+        if chunk is None:
+            return self.items[0]
+        return self.items[chunk[(row % size) * size + column % size]]
+
+    def setItem(self, item, row, column):
+        """
+        Sets a cell to an item. A chunk that isn't loaded is read
+        immediately.
+        """
+        size = self.chunkSize
+        key = (row // size, column // size)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.restoreItems(key, self.world.readChunk(*key))
+            self.chunks.put(key, chunk)
+            if key in self.pending:
+                self.stale.add(key)
+        chunk[(row % size) * size + column % size] = self.itemId(item)
+        self.modified.add(key)
+
+    def close(self):
+        """
+        Stops the loading thread, writes back modified chunks and closes
+        the world file
+        """
+        # chunks still waiting to be read are no longer wanted
+        while True:
+            try:
+                self.requests.get_nowait()
+            except Queue.Empty:
+                break
+        self.requests.put(None)
+        self.thread.join()
+        self.pending.clear()
+        self.stale.clear()
+        for key in list(self.modified):
+            self.writeBack(key, self.chunks.entries[key])
+        self.world.close()